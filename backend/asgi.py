@@ -0,0 +1,396 @@
+'''
+-----------------------------------------------------------
+Async serving mode.
+
+Run with an ASGI server from the backend directory:
+    uvicorn asgi:app --workers 4
+
+The read endpoints that carry most of the traffic are served
+natively with an async database driver (asyncpg for Postgres,
+aiosqlite for SQLite), so one process keeps many requests in
+flight while they wait on the database:
+    GET  /categories
+    GET  /questions
+    POST /categories/<id>/questions
+    POST /quizzes
+Every other route, OPTIONS preflights, and requests using query
+arguments the native routes do not implement (see FLASK_ARGUMENTS)
+are passed to the Flask app from create_app() through asgiref's
+WSGI adapter.
+Responses and errors have the same JSON shapes in both paths.
+-----------------------------------------------------------
+'''
+import asyncio
+import json
+import re
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import quiz
+from models import on_change, database_path, Question, Category
+from lib import QUESTIONS_PER_PAGE, VERSION_CHECK_INTERVAL, category_snapshot
+
+QUESTION_COLUMNS = 'id, question, answer, category, difficulty'
+
+# Query arguments of the Flask routes that the native routes do not
+# implement: requests using them are served by the Flask app.
+LISTING_ARGUMENTS = ('difficulty', 'search', 'fields')
+FLASK_ARGUMENTS = {
+    'categories': ('with_counts',),
+    'questions': LISTING_ARGUMENTS,
+    'questions_by_category': LISTING_ARGUMENTS,
+    'quizzes': ('fields',),
+}
+
+ERROR_MESSAGES = {
+    400: 'bad request',
+    404: 'resource not found',
+    422: 'unprocessable',
+    500: 'internal server error',
+    503: 'service unavailable',
+}
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        self.status = status
+
+'''
+AsyncDatabase(url)
+    a minimal async query runner over asyncpg or aiosqlite.
+    Queries use ? placeholders; they are rewritten to $1, $2...
+    for asyncpg.
+'''
+class AsyncDatabase:
+    def __init__(self, url):
+        self.url = url
+        self.scheme = urlsplit(url).scheme.split('+')[0]
+        self.pool = None
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        async with self.lock:
+            if self.pool is not None:
+                return
+            if self.scheme in ('postgres', 'postgresql'):
+                import asyncpg
+                dsn = 'postgresql://' + self.url.split('://', 1)[1]
+                self.pool = await asyncpg.create_pool(dsn)
+            elif self.scheme == 'sqlite':
+                import aiosqlite
+                path = self.url.split('://', 1)[1][1:] or ':memory:'
+                self.pool = await aiosqlite.connect(path)
+            else:
+                raise RuntimeError('no async driver for ' + self.scheme)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def fetch(self, sql, *args):
+        if self.pool is None:
+            await self.connect()
+        if self.scheme == 'sqlite':
+            async with self.pool.execute(sql, args) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+        counter = iter(range(1, len(args) + 1))
+        sql = re.sub(r'\?', lambda match: '$%d' % next(counter), sql)
+        return [tuple(row) for row in await self.pool.fetch(sql, *args)]
+
+    async def fetchval(self, sql, *args):
+        rows = await self.fetch(sql, *args)
+        return rows[0][0] if rows else None
+
+def format_question(row):
+    question_id, question, answer, category, difficulty = row
+    return {
+      'id': question_id,
+      'question': question,
+      'answer': answer,
+      'category': category,
+      'difficulty': difficulty
+    }
+
+# Async counterpart of lib.VersionedCache: a value loaded by the
+# coroutine function loader, reloaded when the version counter name
+# moves, which is read at most once per VERSION_CHECK_INTERVAL.
+class AsyncVersionedCache:
+    def __init__(self, database, name, loader):
+        self.database = database
+        self.name = name
+        self.loader = loader
+        self.version = None
+        self.value = None
+        self.checked_at = 0
+
+    async def get(self):
+        return await refresh(self.database, self, self.loader)
+
+    def invalidate(self):
+        self.value = None
+
+# Function to return the value of cache (an AsyncVersionedCache or a
+# lib.VersionedCache shared with the Flask routes), reloading it with
+# the coroutine function loader when its version counter moved.
+async def refresh(database, cache, loader):
+    now = time.monotonic()
+    if cache.value is None or now - cache.checked_at >= VERSION_CHECK_INTERVAL:
+        version = await database.fetchval(
+            'SELECT value FROM versions WHERE name = ?', cache.name) or 0
+        cache.checked_at = now
+        if cache.value is None or version != cache.version:
+            cache.value = await loader()
+            cache.version = version
+    return cache.value
+
+# Async counterparts of the in-process caches of lib and quiz. They
+# share the same data (CategorySnapshot, quiz id pools) and the same
+# invalidation: models.on_change for the writes of this process, the
+# version counters for those of other workers.
+class AsyncCaches:
+    def __init__(self, database):
+        self.database = database
+        self.categories = AsyncVersionedCache(database, 'categories', self._load_categories)
+        self.question_count = AsyncVersionedCache(database, 'questions', self._count_questions)
+        on_change(self._on_change)
+
+    def _on_change(self, action, record):
+        if record is Category or isinstance(record, Category):
+            self.categories.invalidate()
+        if record is Question or isinstance(record, Question):
+            self.question_count.invalidate()
+
+    async def _load_categories(self):
+        return category_snapshot(await self.database.fetch('SELECT id, type FROM categories ORDER BY id'))
+
+    async def _count_questions(self):
+        return await self.database.fetchval('SELECT count(*) FROM questions')
+
+    async def category_snapshot(self):
+        return await self.categories.get()
+
+    async def count_questions(self):
+        return await self.question_count.get()
+
+    async def _load_pool(self, category_id):
+        if category_id == quiz.ALL_CATEGORIES:
+            rows = await self.database.fetch('SELECT id FROM questions')
+        else:
+            rows = await self.database.fetch('SELECT id FROM questions WHERE category = ?', category_id)
+        return quiz.IdPool(question_id for question_id, in rows)
+
+    async def quiz_pool(self, category_id):
+        cache = quiz._pools.get(category_id)
+        if cache is None:
+            snapshot = await self.category_snapshot()
+            cache = quiz.category_cache(quiz._pools, category_id, snapshot.map, quiz.load_pool)
+        if cache is None:
+            return await self._load_pool(category_id)
+        return await refresh(self.database, cache, lambda: self._load_pool(category_id))
+
+class Request:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.args = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        self.headers = dict((key.decode('latin-1').lower(), value.decode('latin-1'))
+                            for key, value in scope.get('headers', []))
+        self.body = body
+
+    def arg(self, name, default):
+        try:
+            return int(self.args[name][0])
+        except (KeyError, ValueError):
+            return default
+
+    def get_json(self):
+        if not self.body:
+            return None
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            raise HTTPError(400)
+
+class TriviaASGI:
+    def __init__(self, flask_app, database):
+        from asgiref.wsgi import WsgiToAsgi
+        self.flask_app = flask_app
+        self.fallback = WsgiToAsgi(flask_app)
+        self.database = database
+        self.caches = AsyncCaches(database)
+        self.routes = [
+            ('GET', re.compile(r'^/categories$'), self.categories),
+            ('GET', re.compile(r'^/questions$'), self.questions),
+            ('POST', re.compile(r'^/categories/(\d+)/questions$'), self.questions_by_category),
+            ('POST', re.compile(r'^/quizzes$'), self.quizzes),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http':
+            for method, pattern, handler in self.routes:
+                match = pattern.match(scope['path'])
+                if match and scope['method'] == method:
+                    if self.needs_flask(handler, scope):
+                        break
+                    return await self.dispatch(handler, match.groups(), scope, receive, send)
+        await self.fallback(scope, receive, send)
+
+    def needs_flask(self, handler, scope):
+        args = parse_qs(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True)
+        return any(name in args for name in FLASK_ARGUMENTS.get(handler.__name__, ()))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.database.connect()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.database.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, handler, params, scope, receive, send):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        request = Request(scope, body)
+        try:
+            if not await self.ensure_ready():
+                raise HTTPError(503)
+            status, payload, headers = await handler(request, *params)
+        except HTTPError as e:
+            status, payload, headers = e.status, self.error(e.status), {}
+        except Exception as e:
+            self.flask_app.logger.exception(e)
+            status, payload, headers = 500, self.error(500), {}
+        if isinstance(payload, dict):
+            payload = (json.dumps(payload, sort_keys=True, separators=(',', ':')) + '\n').encode('utf-8')
+        headers = dict(headers, **self.cors_headers(request))
+        headers['Content-Type'] = 'application/json'
+        headers['Content-Length'] = str(len(payload))
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(key.lower().encode('latin-1'), value.encode('latin-1'))
+                                for key, value in headers.items()]})
+        await send({'type': 'http.response.body', 'body': payload})
+
+    # Function to set up the database of the Flask app (see startup.py)
+    # before the first native request, as its before_request hook does
+    # for the Flask routes. The setup is blocking, so it runs in the
+    # default executor; once it succeeded this costs one attribute read.
+    async def ensure_ready(self):
+        readiness = self.flask_app.extensions['trivia_readiness']
+        if readiness.ready:
+            return True
+        return await asyncio.get_running_loop().run_in_executor(None, readiness.ensure)
+
+    def error(self, status):
+        return {'success': False, 'error': status, 'message': ERROR_MESSAGES[status]}
+
+    # Same headers as flask_cors (supports_credentials) and after_request
+    def cors_headers(self, request):
+        headers = {
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+            'Access-Control-Allow-Methods': 'GET, POST, PATCH, DELETE, OPTIONS',
+        }
+        origin = request.headers.get('origin')
+        if origin:
+            headers['Access-Control-Allow-Origin'] = origin
+            headers['Access-Control-Allow-Credentials'] = 'true'
+        return headers
+
+    async def categories(self, request):
+        snapshot = await self.caches.category_snapshot()
+        etag = '"%s"' % snapshot.etag
+        if etag in [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]:
+            return 304, b'', {'ETag': etag}
+        return 200, snapshot.body, {'ETag': etag}
+
+    async def page(self, request, where='', *params):
+        after_id = request.arg('after_id', None)
+        if after_id is not None:
+            rows = await self.database.fetch(
+                'SELECT %s FROM questions WHERE id > ? %s ORDER BY id LIMIT ?'
+                % (QUESTION_COLUMNS, 'AND ' + where if where else ''),
+                after_id, *(params + (QUESTIONS_PER_PAGE,)))
+        else:
+            offset = (max(request.arg('page', 1), 1) - 1) * QUESTIONS_PER_PAGE
+            rows = await self.database.fetch(
+                'SELECT %s FROM questions %s ORDER BY id LIMIT ? OFFSET ?'
+                % (QUESTION_COLUMNS, 'WHERE ' + where if where else ''),
+                *(params + (QUESTIONS_PER_PAGE, offset)))
+        formatted_questions = [format_question(row) for row in rows]
+        known = (await self.caches.category_snapshot()).map
+        categories = dict((question['category'], known[question['category']])
+                          for question in formatted_questions if question['category'] in known)
+        return formatted_questions, categories
+
+    async def questions(self, request):
+        formatted_questions, categories = await self.page(request)
+        return 200, {'success': True,
+                     'currentCategory': None,
+                     'categories': categories,
+                     'totalQuestions': await self.caches.count_questions(),
+                     'questions': formatted_questions}, {}
+
+    async def questions_by_category(self, request, category_id):
+        category_id = int(category_id)
+        total_questions = await self.database.fetchval(
+            'SELECT count(*) FROM questions WHERE category = ?', category_id)
+        if not total_questions:
+            raise HTTPError(404)
+        formatted_questions, categories = await self.page(request, 'category = ?', category_id)
+        return 200, {'success': True,
+                     'currentCategory': None,
+                     'categories': categories,
+                     'totalQuestions': total_questions,
+                     'questions': formatted_questions}, {}
+
+    async def quizzes(self, request):
+        data = request.get_json()
+        try:
+            previous_questions = data['previous_questions']
+            category_id = quiz.quiz_category_id(data['quiz_category'])
+            exclude = set(int(question_id) for question_id in previous_questions)
+        except (TypeError, KeyError, ValueError):
+            raise HTTPError(422)
+        pool = await self.caches.quiz_pool(category_id)
+        formatted_question = None
+        while True:
+            question_id = pool.sample(exclude)
+            if question_id is None:
+                break
+            rows = await self.database.fetch(
+                'SELECT %s FROM questions WHERE id = ?' % QUESTION_COLUMNS, question_id)
+            if rows:
+                formatted_question = format_question(rows[0])
+                break
+            pool.remove(question_id)
+        return 200, {'success': True,
+                     'previous_questions': previous_questions,
+                     'question': formatted_question}, {}
+
+'''
+create_asgi_app(flask_app=None, database_url=None)
+    returns the ASGI application. flask_app defaults to a new
+    create_app(); database_url to the URI it is configured with.
+'''
+def create_asgi_app(flask_app=None, database_url=None):
+    if flask_app is None:
+        from flaskr import create_app
+        flask_app = create_app()
+    database_url = database_url or flask_app.config.get('SQLALCHEMY_DATABASE_URI', database_path)
+    return TriviaASGI(flask_app, AsyncDatabase(database_url))
+
+# `uvicorn asgi:app` builds the app on first access, so importing this
+# module for create_asgi_app() does not touch the database.
+def __getattr__(name):
+    if name == 'app':
+        globals()['app'] = create_asgi_app()
+        return globals()['app']
+    raise AttributeError(name)
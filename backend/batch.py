@@ -0,0 +1,93 @@
+from models import db, notify, bump_version, Question, Category
+
+# Most ids accepted in one batch request
+MAX_BATCH_IDS = 10000
+
+# Fields a batch update or a PATCH may change
+EDITABLE_FIELDS = ('question', 'answer', 'category', 'difficulty')
+
+# Function to return a value sent as a string of digits (form fields
+# send their values as strings) as an integer; other values unchanged
+def as_integer(value):
+    if isinstance(value, str) and value.strip().lstrip('-+').isdigit():
+        return int(value)
+    return value
+
+# Function to check a difficulty value: an integer from 1 to 5
+def check_difficulty(value):
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= 5:
+        raise ValueError('difficulty must be an integer between 1 and 5')
+    return value
+
+# Function to check a category id: an existing category
+def check_category(value):
+    if isinstance(value, bool) or not isinstance(value, int) \
+            or db.session.query(Category.id).filter(Category.id == value).scalar() is None:
+        raise ValueError('unknown category')
+    return value
+
+# Function to return the values of a question update, checked.
+# Raises ValueError for unknown fields or invalid values.
+def check_values(values, fields=EDITABLE_FIELDS):
+    if not isinstance(values, dict) or not values:
+        raise ValueError('nothing to change')
+    for field, value in values.items():
+        if field not in fields:
+            raise ValueError('%s cannot be changed' % field)
+        if field == 'difficulty':
+            check_difficulty(value)
+        elif field == 'category':
+            check_category(value)
+        elif not isinstance(value, str) or not value.strip():
+            raise ValueError('%s must be a non-empty string' % field)
+    return values
+
+'''
+select_questions(ids=None, filter=None)
+    returns the query for a batch: the questions with the given ids,
+    and/or those matching filter ({'category': id, 'difficulty': n}).
+    One of them is required, so a batch never touches the whole
+    table by accident.
+'''
+def select_questions(ids=None, filter=None):
+    selection = Question.query
+    if ids is None and not filter:
+        raise ValueError('ids or filter is required')
+    if ids is not None:
+        if not isinstance(ids, list) or len(ids) > MAX_BATCH_IDS \
+                or not all(isinstance(question_id, int) for question_id in ids):
+            raise ValueError('ids must be a list of at most %d ids' % MAX_BATCH_IDS)
+        selection = selection.filter(Question.id.in_(ids))
+    for field, value in (filter or {}).items():
+        if field not in ('category', 'difficulty'):
+            raise ValueError('cannot filter on %s' % field)
+        selection = selection.filter(getattr(Question, field) == value)
+    return selection
+
+# Function to run one set-based write in one transaction and return
+# the number of rows it touched. It bypasses Question.insert() and
+# delete(), so derived caches are reset afterwards.
+def _write(write):
+    try:
+        count = write()
+        if count:
+            bump_version('questions')
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if count:
+        notify('reset', Question)
+    return count
+
+# Function to delete the questions of a batch with one DELETE
+def delete_questions(selection):
+    return _write(lambda: selection.delete(synchronize_session=False))
+
+# Function to change category and/or difficulty of the questions of
+# a batch with one UPDATE
+def update_questions(selection, values):
+    check_values(values, fields=('category', 'difficulty'))
+    return _write(lambda: selection.update(
+        {getattr(Question, field): value for field, value in values.items()},
+        synchronize_session=False))
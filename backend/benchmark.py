@@ -0,0 +1,351 @@
+'''
+-----------------------------------------------------------
+Benchmark harness.
+
+Seeds a database with generated questions, then drives the
+busiest endpoints through the Flask test client and over real
+HTTP and reports throughput, p50/p95/p99 latency and SQL
+statements per request (read from the Server-Timing header).
+Runs offline against SQLite or a local Postgres:
+
+    python benchmark.py --database-url sqlite:////tmp/bench.db \
+        --questions 100000 --categories 20 --output bench.json
+
+The database at --database-url is dropped and re-created
+unless --no-seed is given. Compare two runs with
+    python benchmark.py --compare before.json after.json
+
+Micro-benchmarks of the question index against list scans,
+in memory, without a database:
+    python benchmark.py --index-sizes 10000,100000,1000000
+-----------------------------------------------------------
+'''
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+WORDS = ('river mountain painter novel planet element king queen war city ocean movie '
+         'album player team country island language bridge tower empire desert forest '
+         'composer poet engine theory metal animal bird flower castle volcano').split()
+
+ENDPOINTS = ('questions_page', 'search', 'category_questions', 'quizzes')
+
+SQL_COUNT = re.compile(r'(\d+) queries')
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the trivia API.')
+    parser.add_argument('--database-url', default='sqlite:////tmp/trivia_bench.db')
+    parser.add_argument('--questions', type=int, default=1000,
+                        help='questions to seed, e.g. 1000, 100000 or 1000000')
+    parser.add_argument('--categories', type=int, default=6)
+    parser.add_argument('--no-seed', action='store_true', help='reuse the existing data')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and mode')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--modes', default='client,http', help='client, http or both')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RESULT'),
+                        help='print the change between two result files and exit')
+    parser.add_argument('--index-sizes', metavar='N,N,...',
+                        help='run the question index micro-benchmarks at these sizes and exit')
+    return parser.parse_args(argv)
+
+# Function to generate question rows (question, answer, difficulty,
+# category) in the format importer.insert_batch() takes.
+def generate_questions(count, category_ids, rng):
+    for n in range(count):
+        words = rng.sample(WORDS, 4)
+        yield ('Which %s is known for its %s and %s? (#%d)' % (words[0], words[1], words[2], n),
+               '%s %d' % (words[3], n),
+               rng.randint(1, 5),
+               category_ids[n % len(category_ids)])
+
+# Function to run one script of migrations/ on the app's database
+def apply_migration(db, name):
+    from sqlalchemy import text
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations', name)) as f:
+        script = f.read()
+    with db.engine.begin() as connection:
+        connection.execute(text(script))
+
+'''
+seed(app, questions, categories, rng)
+    drops and re-creates the schema, then inserts the categories
+    and questions in batches (COPY on Postgres).
+'''
+def seed(app, questions, categories, rng):
+    from models import db, notify, Question, Category
+    from importer import insert_batch
+    from search import setup_search_index
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        if db.engine.dialect.name == 'postgresql':
+            apply_migration(db, '0003_search_trigram.sql')
+        setup_search_index()
+        category_ids = []
+        for n in range(categories):
+            category = Category(type='Category %d' % (n + 1))
+            category.insert()
+            category_ids.append(category.id)
+        batch = []
+        for row in generate_questions(questions, category_ids, rng):
+            batch.append(row)
+            if len(batch) >= 10000:
+                insert_batch(batch)
+                batch = []
+        if batch:
+            insert_batch(batch)
+        notify('reset', Question)
+        return category_ids
+
+# Function to return a callable building (method, path, json body)
+# for each request of an endpoint.
+def request_factory(name, questions, category_ids, rng):
+    pages = max(questions // 10, 1)
+    if name == 'questions_page':
+        return lambda: ('GET', '/questions?page=%d' % rng.randint(1, pages), None)
+    if name == 'search':
+        return lambda: ('POST', '/questions/search', {'searchTerm': rng.choice(WORDS)})
+    if name == 'category_questions':
+        return lambda: ('POST', '/categories/%d/questions' % rng.choice(category_ids), None)
+    if name == 'quizzes':
+        return lambda: ('POST', '/quizzes', {
+            'previous_questions': [rng.randint(1, max(questions, 1)) for _ in range(5)],
+            'quiz_category': {'id': rng.choice([0] + category_ids)}})
+    raise ValueError('unknown endpoint ' + name)
+
+class TestClientDriver:
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def __call__(self, method, path, body):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+class HTTPDriver:
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        # One access log line per request would dominate the timings
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.base = 'http://127.0.0.1:%d' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def __call__(self, method, path, body):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(self.base + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('Server-Timing', '')
+
+    def close(self):
+        self.server.shutdown()
+
+# Function to return the value at percentile p of sorted values
+def percentile(values, p):
+    if not values:
+        return None
+    index = min(int(round(p / 100.0 * len(values) + 0.5)) - 1, len(values) - 1)
+    return values[max(index, 0)]
+
+'''
+run_endpoint(driver, make_request, requests, warmup, concurrency)
+    sends warmup requests, then requests more from concurrency
+    threads and returns throughput, latency percentiles (ms),
+    errors and the mean number of SQL statements per request.
+'''
+def run_endpoint(driver, make_request, requests, warmup, concurrency):
+    for _ in range(warmup):
+        driver(*make_request())
+    planned = [make_request() for _ in range(requests)]
+
+    def timed(planned_request):
+        start = time.perf_counter()
+        status, server_timing = driver(*planned_request)
+        elapsed = time.perf_counter() - start
+        match = SQL_COUNT.search(server_timing)
+        return elapsed, status, int(match.group(1)) if match else None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(timed, planned))
+    wall = time.perf_counter() - start
+    latencies = sorted(elapsed * 1000 for elapsed, status, statements in samples)
+    statements = [statements for elapsed, status, statements in samples if statements is not None]
+    return {
+      'requests': len(samples),
+      'errors': sum(1 for elapsed, status, _ in samples if status >= 500),
+      'throughput': round(len(samples) / wall, 1) if wall else None,
+      'p50_ms': round(percentile(latencies, 50), 3),
+      'p95_ms': round(percentile(latencies, 95), 3),
+      'p99_ms': round(percentile(latencies, 99), 3),
+      'max_ms': round(latencies[-1], 3),
+      'sql_per_request': round(sum(statements) / len(statements), 2) if statements else None
+    }
+
+# Function to return the mean microseconds per call of fn
+def time_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return round((time.perf_counter() - start) / repeat * 1e6, 3)
+
+'''
+index_benchmark(sizes, categories, rng)
+    times the listing helpers on size questions, with plain list
+    scans (how lib worked before the question index) and with the
+    index: a deep page of a category, an unseen question of a
+    category (20 seen; drawn from a quiz IdPool) and a category +
+    difficulty + text filter.
+    Returns microseconds per call by size, operation and method.
+'''
+def index_benchmark(sizes, categories, rng):
+    from question_index import QuestionIndex, page_ids
+    from quiz import IdPool
+    results = {}
+    for size in sizes:
+        rows = [(question_id, question_id % categories + 1, rng.randint(1, 5),
+                 rng.choice(WORDS) + ' ' + rng.choice(WORDS)) for question_id in range(1, size + 1)]
+        index = QuestionIndex((question_id, category, difficulty)
+                              for question_id, category, difficulty, text in rows)
+        category = categories // 2 + 1
+        page = max(size // categories // 10 // 2, 1)
+        seen = rng.sample(list(index.select(category)), 20)
+        matches = set(question_id for question_id, _, _, text in rows if 'river' in text)
+        repeat = max(10, 1000000 // size)
+
+        def scan_page():
+            in_category = [row for row in rows if row[1] == category]
+            return in_category[(page - 1) * 10:page * 10]
+
+        def scan_subtract():
+            excluded = set(seen)
+            return [row for row in rows if row[1] == category and row[0] not in excluded]
+
+        def scan_filter():
+            return [row[0] for row in rows if row[1] == category and row[2] == 3 and 'river' in row[3]]
+
+        pool = IdPool(index.select(category))
+
+        def index_subtract():
+            return pool.sample(set(seen))
+
+        results[size] = {
+            'page': {'scan': time_call(scan_page, repeat),
+                     'index': time_call(lambda: page_ids(index.select(category), page), repeat * 100)},
+            'subtract': {'scan': time_call(scan_subtract, repeat),
+                         'index': time_call(index_subtract, repeat * 100)},
+            'filter': {'scan': time_call(scan_filter, repeat),
+                       'index': time_call(lambda: index.select(category, 3, matches), repeat)},
+        }
+        print('%-8d %s' % (size, json.dumps(results[size])), file=sys.stderr)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Function to print the change of p95 latency and throughput between
+# two result files, endpoint by endpoint.
+def compare(baseline_path, result_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(result_path) as f:
+        result = json.load(f)
+    print('%-8s %-20s %12s %12s %9s %12s' % ('mode', 'endpoint', 'p95 before', 'p95 after', 'change', 'throughput'))
+    for mode, endpoints in sorted(result['results'].items()):
+        for name, after in sorted(endpoints.items()):
+            before = baseline['results'].get(mode, {}).get(name)
+            if not before:
+                continue
+            change = (after['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+            print('%-8s %-20s %10.2fms %10.2fms %+8.1f%% %5s -> %-5s' % (
+                mode, name, before['p95_ms'], after['p95_ms'], change,
+                before['throughput'], after['throughput']))
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.index_sizes:
+        results = index_benchmark([int(size) for size in args.index_sizes.split(',')],
+                                  args.categories, random.Random(args.seed))
+        print(json.dumps({'commit': git_commit(), 'categories': args.categories, 'index': results},
+                         indent=2, sort_keys=True))
+        return
+    # models reads DATABASE_URL when it is imported
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SLOW_REQUEST_MS', '0')
+    from flaskr import create_app
+    from models import db, Category, Question
+    app = create_app()
+    rng = random.Random(args.seed)
+
+    started = time.perf_counter()
+    if args.no_seed:
+        with app.app_context():
+            category_ids = [category_id for category_id, in db.session.query(Category.id)]
+            questions = Question.query.count()
+    else:
+        category_ids = seed(app, args.questions, args.categories, rng)
+        questions = args.questions
+    seed_seconds = time.perf_counter() - started
+    print('database ready: %d questions, %d categories (%.1fs)'
+          % (questions, len(category_ids), seed_seconds), file=sys.stderr)
+
+    results = {}
+    for mode in args.modes.split(','):
+        driver = TestClientDriver(app) if mode == 'client' else HTTPDriver(app)
+        results[mode] = {}
+        for name in args.endpoints.split(','):
+            make_request = request_factory(name, questions, category_ids, rng)
+            results[mode][name] = run_endpoint(driver, make_request, args.requests,
+                                               args.warmup, args.concurrency)
+            print('%-6s %-20s %s' % (mode, name, json.dumps(results[mode][name])), file=sys.stderr)
+        if mode == 'http':
+            driver.close()
+
+    report = {
+      'commit': git_commit(),
+      'database': db.engine.dialect.name,
+      'questions': questions,
+      'categories': len(category_ids),
+      'requests': args.requests,
+      'concurrency': args.concurrency,
+      'seedSeconds': round(seed_seconds, 2),
+      'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import functools
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, request
+from lib import stats_cache, category_cache
+from metrics import register_collector, format_labels
+
+# Response cache settings, read from app.config, then the environment
+CACHE_SETTINGS = {
+    'RESPONSE_CACHE': 'memory',     # memory, file or off
+    'RESPONSE_CACHE_SIZE': 1024,    # most entries kept
+    'RESPONSE_CACHE_TTL': 60,       # seconds an entry is served
+    'RESPONSE_CACHE_DIR': '',       # file cache directory, default private_directory()
+}
+
+def cache_setting(config, name):
+    default = CACHE_SETTINGS[name]
+    return type(default)(config.get(name, os.environ.get(name, default)))
+
+'''
+Cache backends
+    get(key) returns the stored value or None, set(key, value) stores
+    it, clear() drops everything. Values are (status, body, mimetype)
+    tuples; keys are hex digests.
+'''
+# In-process LRU with a TTL. Each worker has its own.
+class MemoryBackend:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+# One file per entry in a directory every worker of the host shares.
+# A local stand-in for a shared cache service: entries written by one
+# worker are served by the others. Least recently read files go first.
+# An entry is a JSON header line (expiry, status, mimetype, length)
+# followed by the raw body, so reading one never runs code.
+class FileBackend:
+    def __init__(self, directory, max_entries, ttl):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def __len__(self):
+        return len(self._files())
+
+    def _files(self):
+        return [name for name in os.listdir(self.directory) if name.endswith('.cache')]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.cache')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+                body = f.read()
+            expires_at, status, mimetype, length = (header['expires_at'], header['status'],
+                                                    header['mimetype'], header['length'])
+        except (OSError, ValueError, TypeError, KeyError):
+            return None
+        if len(body) != length or time.time() >= expires_at:
+            return None
+        os.utime(path)
+        return status, body, mimetype
+
+    def set(self, key, value):
+        status, body, mimetype = value
+        header = {'expires_at': time.time() + self.ttl, 'status': status,
+                  'mimetype': mimetype, 'length': len(body)}
+        # Write then rename, so readers never see a partial entry
+        fd, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(body)
+        os.replace(temporary, self._path(key))
+        files = self._files()
+        if len(files) > self.max_entries:
+            paths = sorted((os.path.join(self.directory, name) for name in files), key=_mtime)
+            for path in paths[:len(files) - self.max_entries]:
+                _remove(path)
+
+    def clear(self):
+        for name in self._files():
+            _remove(os.path.join(self.directory, name))
+
+'''
+private_directory()
+    returns the default directory of the file cache: one per user
+    under the temporary directory, created with mode 0700 so other
+    local users can neither read nor plant entries. Raises
+    RuntimeError when it exists but is not owned by this user or is
+    open to others.
+'''
+def private_directory():
+    directory = os.path.join(tempfile.gettempdir(), 'trivia-response-cache-%d' % os.getuid())
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError('response cache directory %s is not private; set RESPONSE_CACHE_DIR' % directory)
+    return directory
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# Response cache with hit and miss counters per endpoint
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+
+    def count(self, counters, endpoint):
+        with self.lock:
+            counters[endpoint] = counters.get(endpoint, 0) + 1
+
+    def stats(self):
+        return {'entries': len(self.backend),
+                'hits': dict(self.hits),
+                'misses': dict(self.misses)}
+
+# Function to return the cache key of the current request: endpoint,
+# path, query string and body, plus the data versions, so every write
+# that bumps 'questions' or 'categories' moves readers to new keys.
+# The versions come from the in-process caches, which check them
+# against the database at most once per VERSION_CHECK_INTERVAL.
+def request_key():
+    stats_cache.get()
+    category_cache.get()
+    parts = [request.endpoint, request.method, request.path,
+             '&'.join(sorted('%s=%s' % item for item in request.args.items(multi=True))),
+             hashlib.sha1(request.get_data()).hexdigest(),
+             str(stats_cache.version), str(category_cache.version)]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+'''
+cached_response
+    decorator for views whose response only depends on the request
+    and the question and category data. 200 responses are stored in
+    the app's response cache and served from it until they expire or
+    the data changes. Responses carry X-Cache: HIT or MISS.
+'''
+def cached_response(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions.get('trivia_response_cache')
+        if cache is None:
+            return view(*args, **kwargs)
+        key = request_key()
+        entry = cache.backend.get(key)
+        if entry is not None:
+            cache.count(cache.hits, request.endpoint)
+            status, body, mimetype = entry
+            response = current_app.response_class(body, status=status, mimetype=mimetype)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+        cache.count(cache.misses, request.endpoint)
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            cache.backend.set(key, (response.status_code, response.get_data(), response.mimetype))
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+'''
+init_response_cache(app)
+    creates the response cache the settings ask for (RESPONSE_CACHE:
+    memory, file or off) and reports its counters in /metrics.
+'''
+def init_response_cache(app):
+    kind = cache_setting(app.config, 'RESPONSE_CACHE')
+    size = cache_setting(app.config, 'RESPONSE_CACHE_SIZE')
+    ttl = cache_setting(app.config, 'RESPONSE_CACHE_TTL')
+    if kind == 'memory':
+        backend = MemoryBackend(size, ttl)
+    elif kind == 'file':
+        directory = cache_setting(app.config, 'RESPONSE_CACHE_DIR') or private_directory()
+        backend = FileBackend(directory, size, ttl)
+    else:
+        return None
+    cache = ResponseCache(backend)
+    app.extensions['trivia_response_cache'] = cache
+
+    @register_collector
+    def cache_metrics():
+        lines = ['# HELP trivia_response_cache_requests_total Cached view lookups.',
+                 '# TYPE trivia_response_cache_requests_total counter']
+        for result, counters in (('hit', cache.hits), ('miss', cache.misses)):
+            for endpoint, value in sorted(counters.items()):
+                lines.append('trivia_response_cache_requests_total{%s} %d'
+                             % (format_labels(('endpoint', 'result'), (endpoint, result)), value))
+        lines.append('trivia_response_cache_entries %d' % len(backend))
+        return lines
+    return cache
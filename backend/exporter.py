@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+import zlib
+from models import db, Question
+
+# Rows fetched per query while walking the table
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+CONTENT_TYPES = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Function to yield the questions (as column tuples) in id order, one
+# keyset batch at a time: each batch is a short "id > last id" query on
+# the primary key, so memory stays flat and no cursor is held open
+# between batches.
+def iter_questions(category_id=None, batch_size=EXPORT_BATCH_SIZE):
+    columns = [getattr(Question, column) for column in EXPORT_COLUMNS]
+    last_id = 0
+    while True:
+        selection = db.session.query(*columns).filter(Question.id > last_id)
+        if category_id is not None:
+            selection = selection.filter(Question.category == category_id)
+        rows = selection.order_by(Question.id).limit(batch_size).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+# Function to turn batches of rows into text chunks, one per batch.
+# Both formats can be fed back to import_questions().
+def format_batches(batches, fmt):
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in batches:
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.getvalue():
+            yield buffer.getvalue()
+        return
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n' for row in rows)
+
+# Function to gzip a stream of byte chunks on the fly
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+'''
+export_questions(fmt, category_id=None, compress=False)
+    returns a generator of byte chunks holding every question (or
+    those of one category) as JSON Lines or CSV, gzip-compressed
+    when compress is true.
+'''
+def export_questions(fmt='jsonl', category_id=None, compress=False, batch_size=EXPORT_BATCH_SIZE):
+    chunks = (text.encode('utf-8')
+              for text in format_batches(iter_questions(category_id, batch_size), fmt))
+    return gzip_chunks(chunks) if compress else chunks
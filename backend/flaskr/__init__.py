@@ -1,27 +1,59 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
 import os
-from flask import Flask, request, abort, jsonify, flash, current_app, redirect, url_for
+import click
+from flask import Flask, request, abort, flash, current_app, redirect, url_for, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import random
 from flask_cors import cross_origin
 
 #Import exceptions
-from sqlalchemy import exc
+from sqlalchemy import exc, text
 
 #Import supporting functions
 from lib import *
+from models import database_path
+from quiz import next_question, quiz_category_id, quiz_sessions, SESSION_TTL, \
+    pick_adaptive_question, next_difficulty, START_DIFFICULTY
+from search import find_questions
+from metrics import init_metrics, render_metrics
+from serializers import jsonify, init_compression, requested_fields
+from cache import init_response_cache, cached_response
+from store import init_question_store
+from writer import init_writer
+from startup import StartupTimer, secret_key, init_readiness, ensure_ready, startup_log
+
+# The import, export and batch modules are imported by the routes that
+# use them, so workers do not load them before they are needed.
 
+# Seconds spent importing this module and its dependencies
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
 
 # QUESTIONS_PER_PAGE = 10
-SECRET_KEY = os.urandom(32)
 
 def create_app(test_config=None):
   ''' create and configure the app '''
+  timer = StartupTimer()
+  timer.record('imports', IMPORT_SECONDS)
   app = Flask(__name__, instance_relative_config=True)
+  if test_config is not None:
+      app.config.update(test_config)
   ''' Security '''
-  app.secret_key = SECRET_KEY
-  ''' Database '''
-  db = setup_db(app)
+  app.secret_key = secret_key(app.config)
+  timer.mark('config')
+  ''' Database: the schema is set up on the first request '''
+  db = setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI') or database_path)
+  timer.mark('engine')
+  ''' Instrumentation '''
+  init_metrics(app)
+  ''' Response cache '''
+  init_response_cache(app)
+  ''' In-memory question store '''
+  init_question_store(app, store_cache)
+  ''' Write-behind of question and category writes '''
+  init_writer(app)
   ''' CORS '''
   cors = CORS(app, supports_credentials=True)
   app.config['CORS_HEADERS'] = 'Content-Type'
@@ -33,6 +65,10 @@ def create_app(test_config=None):
       response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PATCH, DELETE, OPTIONS')
       return response
 
+  ''' Compression of large JSON responses '''
+  init_compression(app)
+  timer.mark('extensions')
+
   '''
   -----------------------------------------------------------
   Default endpoint. Not exposed to end user.
@@ -55,24 +91,42 @@ def create_app(test_config=None):
   available categories.
   -----------------------------------------------------------
   ***********************************************************
-  Expected Inputs: None
+  Expected Inputs:
+    If-None-Match header, optional. ETag of a previous response.
+    with_counts: int, optional. 1 adds the number of questions
+        per category and per difficulty.
   Expected Output: Dictionary of categories.
+    Served from the in-process category cache. Returns 304
+    when the client already has the current version.
+    With with_counts=1: questionCounts per category id (and
+    under null, questions without a category, if any) and
+    totalQuestions, from the question statistics.
   ***********************************************************
   -----------------------------------------------------------
-  Linked tests:test_get_categories
+  Linked tests:test_get_categories, test_get_categories_not_modified,
+               test_get_categories_with_counts
   -----------------------------------------------------------
   '''
   @app.route('/categories', methods=['GET'])
   def categories():
     try:
-        categories = Category.query.order_by('id').all()
-        formatted_categories = {category.id: category.type for category in categories}
+        snapshot = category_cache.get()
+        if request.args.get('with_counts', 0, type=int):
+            stats = question_stats()
+            counts = {str(category_id): stats.format(category_id) for category_id in snapshot.map}
+            if stats.count(None):
+                counts['null'] = stats.format(None)
+            return jsonify({'success': True,
+                            'total': len(snapshot.map),
+                            'categories': snapshot.map,
+                            'questionCounts': counts,
+                            'totalQuestions': stats.total})
     except Exception as e:
-        print(e)
+        app.logger.exception(e)
         return jsonify({'message': e})
-    return jsonify({'success': True,
-                    'total' : len(categories),
-                    'categories' : formatted_categories})
+    response = current_app.response_class(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    return response.make_conditional(request)
 
   '''
   -----------------------------------------------------------
@@ -80,7 +134,16 @@ def create_app(test_config=None):
   including pagination (every 10 questions).
   -----------------------------------------------------------
   ***********************************************************
-  Expected Inputs: None
+  Expected Inputs:
+    page: int, optional. Page number, starting at 1.
+    after_id: int, optional. Id of the last question already
+        shown. Returns the next page after it (keyset mode).
+    fields: string, optional. Comma-separated question fields
+        to return, e.g. id,question. Default all of them.
+    difficulty: int, optional. Only questions of this
+        difficulty.
+    search: string, optional. Only questions whose question or
+        answer contains it.
   Expected Output:
     list of all questions from database
     number of total questions
@@ -88,39 +151,43 @@ def create_app(test_config=None):
     categories
   ***********************************************************
   -----------------------------------------------------------
-  Linked tests:test_get_questions
+  Linked tests:test_get_questions, test_get_questions_fields
   -----------------------------------------------------------
   '''
   @app.route('/questions', methods=['GET'])
+  @cached_response
   def questions():
     try:
-      questions = Question.query.order_by('id').all()
-      formatted_questions = paginate_questions(request, questions)
+      ids = listed_ids(request)
+      formatted_questions = paginate_questions(request, ids)
       categories = compile_categories(formatted_questions)
+      total_questions = len(ids)
     except Exception as e:
-        flash(e)
+        app.logger.exception(e)
         return jsonify({'message': e})
     return jsonify({'success': True,
                     'currentCategory': None,
                     'categories' : categories,
-                    'totalQuestions' : len(questions),
+                    'totalQuestions' : total_questions,
                     'questions' : formatted_questions})
 
   '''
   -----------------------------------------------------------
   This endpoint to handles DELETE requests for questions.
-  It returns list of all remaining questions from database.
+  It returns the id of the deleted question and the number
+  of remaining questions.
   -----------------------------------------------------------
   ***********************************************************
   Expected Inputs: id of the question
+    refresh: int, optional. 1 to also return a page of the
+        remaining questions (see page and after_id of GET).
   Expected Output:
-    list of all questions from database
+    id of the deleted question
     number of total questions
-    current category
-    categories
+    with refresh: questions, current category, categories
   ***********************************************************
   -----------------------------------------------------------
-  Linked tests:test_del_question
+  Linked tests:test_del_question, test_del_question_refresh
   -----------------------------------------------------------
   '''
   @app.route('/questions/<int:question_id>/delete', methods=['DELETE'])
@@ -130,64 +197,266 @@ def create_app(test_config=None):
           abort(404)
       try:
           question.delete()
-          questions = Question.query.order_by('id').all()
-          formatted_questions = paginate_questions(request, questions)
-          categories = compile_categories(formatted_questions)
+          response = {'success': True,
+                      'deleted' : question_id,
+                      'totalQuestions' : count_questions()}
+          if request.args.get('refresh', 0, type=int):
+              response.update(questions_page(request))
       except Exception as e:
-          print(e)
+          app.logger.exception(e)
           return jsonify({'success': False,
                           'message' : 'error'})
-      return jsonify({'success': True,
-                      'currentCategory': None,
-                      'categories' : categories,
-                      'totalQuestions' : len(questions),
-                      'questions' : formatted_questions})
+      return jsonify(response)
 
   '''
   -----------------------------------------------------------
   This endpoint handles creation of new questions via POST
-  It returns list of all questions from database.
+  It returns the created question and the number of questions.
   -----------------------------------------------------------
   ***********************************************************
   Expected Inputs:
     question: string. The text of the question
     answer: string. The text of the answer
-    difficulty: int.
-    category: id of the category the question belongs to.
-        Mapped to id column of the categories table.
+    difficulty: int, 1 to 5 (or a string of digits).
+    category: id of the category the question belongs to
+        (or a string of digits). Mapped to id column of the
+        categories table.
+    refresh: int, optional, in the query string. 1 to also
+        return a page of questions (see page and after_id of GET).
   Expected Output:
-    list of all questions from database
+    id of the created question and the question itself
     number of total questions
-    current category
-    categories
+    with refresh: questions, current category, categories
   ***********************************************************
   -----------------------------------------------------------
-  Linked tests:test_add_question, test_del_question
+  Linked tests:test_add_question, test_add_question_422,
+               test_add_question_form_values, test_del_question
   -----------------------------------------------------------
   '''
   @app.route('/questions', methods=['POST'])
   def add_question():
+    from batch import as_integer, check_difficulty
     try:
       que = request.get_json()['question']
       answer = request.get_json()['answer']
-      difficulty = request.get_json()['difficulty']
-      category = request.get_json()['category']
+      difficulty = check_difficulty(as_integer(request.get_json()['difficulty']))
+      category = as_integer(request.get_json()['category'])
       question = Question(question=que, answer=answer, category=category, difficulty=difficulty)
       question.insert()
     except Exception as e:
-        print(e)
-        return jsonify({'message': e})
-    return redirect(url_for('questions'))
+        app.logger.exception(e)
+        abort(422)
+    response = {'success': True,
+                'created' : question.id,
+                'question' : question.format(),
+                'totalQuestions' : count_questions()}
+    if request.args.get('refresh', 0, type=int):
+        response.update(questions_page(request))
+    return jsonify(response)
+
+  '''
+  -----------------------------------------------------------
+  This endpoint edits one question. Only the fields sent are
+  changed.
+  -----------------------------------------------------------
+  ***********************************************************
+  Expected Inputs: id of the question
+    question, answer: string, optional.
+    category: int, optional. Id of an existing category.
+    difficulty: int, optional. 1 to 5.
+  Expected Output:
+    id of the updated question
+    the updated question
+  ***********************************************************
+  -----------------------------------------------------------
+  Linked tests:test_patch_question, test_patch_question_422
+  -----------------------------------------------------------
+  '''
+  @app.route('/questions/<int:question_id>', methods=['PATCH'])
+  def patch_question(question_id):
+      from batch import check_values
+      question = Question.query.filter(Question.id == question_id).one_or_none()
+      if question is None:
+          abort(404)
+      try:
+          values = check_values(request.get_json())
+          for field, value in values.items():
+              setattr(question, field, value)
+          question.update()
+      except ValueError as e:
+          app.logger.info(e)
+          abort(422)
+      return jsonify({'success': True,
+                      'updated' : question_id,
+                      'question' : question.format()})
+
+  '''
+  -----------------------------------------------------------
+  This endpoint deletes or edits many questions at once, in
+  one transaction and one set-based statement. Questions are
+  selected by id, by filter, or both.
+  -----------------------------------------------------------
+  ***********************************************************
+  Expected Inputs:
+    action: string. delete or update.
+    ids: list of int, optional. Ids of the questions.
+    filter: Object, optional. category and/or difficulty the
+        questions must have. ids or filter is required.
+    set: Object, for update. New category and/or difficulty.
+  Expected Output:
+    number of questions deleted or updated
+    number of total questions
+  ***********************************************************
+  -----------------------------------------------------------
+  Linked tests:test_batch_update, test_batch_delete, test_batch_422
+  -----------------------------------------------------------
+  '''
+  @app.route('/questions/batch', methods=['POST'])
+  def batch_questions():
+      from batch import select_questions, delete_questions, update_questions
+      data = request.get_json() or {}
+      action = data.get('action')
+      if action not in ('delete', 'update'):
+          abort(422)
+      try:
+          selection = select_questions(data.get('ids'), data.get('filter'))
+          if action == 'delete':
+              count = delete_questions(selection)
+          else:
+              count = update_questions(selection, data.get('set'))
+      except ValueError as e:
+          app.logger.info(e)
+          abort(422)
+      return jsonify({'success': True,
+                      action + 'd' : count,
+                      'totalQuestions' : count_questions()})
+
+  '''
+  -----------------------------------------------------------
+  This endpoint handles bulk creation of questions.
+  The request body is streamed as JSON Lines or CSV and
+  inserted in batches; it is never loaded whole.
+  The same import is available as `flask import-questions`.
+  -----------------------------------------------------------
+  ***********************************************************
+  Expected Inputs:
+    body: one question per line (JSON Lines) or CSV with a
+        header row. Fields: question, answer, difficulty (1-5)
+        and category (id, or name; unknown names are created).
+    format: string, optional. jsonl or csv. Defaults to csv
+        for text/csv bodies, jsonl otherwise.
+    batch_size: int, optional. Rows per transaction.
+  Expected Output:
+    number of rows read and inserted
+    per-row errors (first 100) and their total count
+    categories created
+  ***********************************************************
+  -----------------------------------------------------------
+  Linked tests:test_import_questions
+  -----------------------------------------------------------
+  '''
+  @app.route('/questions/import', methods=['POST'])
+  def import_questions_upload():
+      from importer import import_questions, detect_format, BATCH_SIZE
+      fmt = request.args.get('format') or detect_format(request.content_type)
+      if fmt not in ('jsonl', 'csv'):
+          abort(400)
+      batch_size = max(request.args.get('batch_size', BATCH_SIZE, type=int), 1)
+      try:
+          report = import_questions(request.stream, fmt, batch_size)
+      except Exception as e:
+          app.logger.exception(e)
+          abort(422)
+      return jsonify(dict(report.format(), success=True))
+
+  @app.cli.command('import-questions')
+  @click.argument('source', type=click.File('rb'))
+  @click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), default=None,
+                help='Input format. Defaults to csv for *.csv files, jsonl otherwise.')
+  @click.option('--batch-size', type=int, default=None,
+                help='Rows per transaction. Defaults to BATCH_SIZE of importer.py.')
+  def import_questions_command(source, fmt, batch_size):
+      ''' Import questions from a JSON Lines or CSV file ('-' for stdin). '''
+      from importer import import_questions, detect_format, BATCH_SIZE
+      ensure_ready(app)
+      def progress(report):
+          click.echo('read %d, inserted %d, errors %d'
+                     % (report.read, report.inserted, report.error_count), err=True)
+      report = import_questions(source, fmt or detect_format(source.name), batch_size or BATCH_SIZE, progress)
+      for error in report.errors:
+          click.echo('line %(line)d: %(message)s' % error, err=True)
+      for category in report.categories_created:
+          click.echo('created category %(id)d: %(type)s' % category, err=True)
+      click.echo('%d questions imported, %d rows rejected' % (report.inserted, report.error_count))
+
+  '''
+  -----------------------------------------------------------
+  This endpoint streams every question out as JSON Lines or
+  CSV, in id order. Rows are read in keyset batches and
+  written as they are read, so memory use does not grow
+  with the table.
+  The same export is available as `flask export-questions`.
+  -----------------------------------------------------------
+  ***********************************************************
+  Expected Inputs:
+    format: string, optional. jsonl (default) or csv.
+    category: int, optional. Only export this category.
+    gzip: int, optional. 1 to gzip the stream.
+  Expected Output:
+    one question per line (id, question, answer, category,
+    difficulty), in a format POST '/questions/import' reads
+  ***********************************************************
+  -----------------------------------------------------------
+  Linked tests:test_export_questions
+  -----------------------------------------------------------
+  '''
+  @app.route('/questions/export', methods=['GET'])
+  def export_questions_download():
+      from exporter import export_questions, CONTENT_TYPES
+      fmt = request.args.get('format', 'jsonl')
+      if fmt not in CONTENT_TYPES:
+          abort(400)
+      category_id = request.args.get('category', None, type=int)
+      if category_id is not None and category_id not in category_map():
+          abort(404)
+      compress = bool(request.args.get('gzip', 0, type=int))
+      filename = 'questions.' + fmt + ('.gz' if compress else '')
+      response = current_app.response_class(
+          stream_with_context(export_questions(fmt, category_id, compress)),
+          mimetype='application/gzip' if compress else CONTENT_TYPES[fmt])
+      response.headers['Content-Disposition'] = 'attachment; filename=' + filename
+      return response
+
+  @app.cli.command('export-questions')
+  @click.argument('output', type=click.File('wb'), default='-')
+  @click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), default=None,
+                help='Output format. Defaults to csv for *.csv files, jsonl otherwise.')
+  @click.option('--category', type=int, default=None, help='Only export this category id.')
+  @click.option('--gzip', 'compress', is_flag=True, default=None,
+                help='Gzip the output. Default for *.gz files.')
+  def export_questions_command(output, fmt, category, compress):
+      ''' Export questions as JSON Lines or CSV to a file ('-' for stdout). '''
+      from importer import detect_format
+      from exporter import export_questions
+      ensure_ready(app)
+      name = getattr(output, 'name', '')
+      name = name if isinstance(name, str) else ''
+      if compress is None:
+          compress = name.endswith('.gz')
+      for chunk in export_questions(fmt or detect_format(name), category, compress):
+          output.write(chunk)
 
   '''
   -----------------------------------------------------------
   This endpoint to handles search of question based on
   partial search term. It returns any questions for whom
-  the search term is a substring of the question.
+  the search term is a substring of the question or answer,
+  question matches first.
   -----------------------------------------------------------
   ***********************************************************
   Expected Inputs:
     search term: string.
+    page: int, optional. Page number, starting at 1.
   Expected Output:
     list of all questions from database
     number of total questions
@@ -195,7 +464,7 @@ def create_app(test_config=None):
     categories
   ***********************************************************
   -----------------------------------------------------------
-  Linked tests:test_search_by_question, test_del_question
+  Linked tests:test_search_by_question, test_search_by_answer, test_del_question
   -----------------------------------------------------------
   '''
 
@@ -203,17 +472,18 @@ def create_app(test_config=None):
   def search_questions():
       data =[]
       try:
-          question = '%' + request.get_json()['searchTerm'] + '%'
-          questions = Question.query.filter(Question.question.ilike(question)).all()
-          formatted_questions = paginate_questions(request, questions)
+          search_term = request.get_json()['searchTerm']
+          page = request.args.get('page', 1, type=int)
+          formatted_questions, total_questions = find_questions(search_term, page,
+                                                              requested_fields(request))
           categories = compile_categories(formatted_questions)
       except Exception as e:
-          print(e)
+          app.logger.exception(e)
           return jsonify({'message': e})
       return jsonify({'success': True,
                       'currentCategory': None,
                       'categories' : categories,
-                      'totalQuestions' : len(formatted_questions),
+                      'totalQuestions' : total_questions,
                       'questions' : formatted_questions})
 
   '''
@@ -225,6 +495,8 @@ def create_app(test_config=None):
   ***********************************************************
   Expected Inputs:
     category_id: int. Id of the category to be searched.
+    page, after_id, fields, difficulty, search: optional,
+        as for GET '/questions'.
   Expected Output:
     list of all questions from database
     number of total questions
@@ -236,21 +508,24 @@ def create_app(test_config=None):
   -----------------------------------------------------------
   '''
   @app.route('/categories/<int:category_id>/questions', methods=['POST'])
+  @cached_response
   def search_questions_by_categories(category_id):
-      questions = get_questions_by_category(category_id)
-      if len(questions)==0:
+      total_questions = count_questions_in_category(category_id)
+      if total_questions==0:
           abort(404)
       try:
-          formatted_questions = paginate_questions(request, questions)
+          ids = listed_ids(request, category_id)
+          formatted_questions = paginate_questions(request, ids)
           categories = compile_categories(formatted_questions)
+          total_questions = len(ids)
       except Exception as e:
-          print(e)
+          app.logger.exception(e)
           return jsonify({'success': False,
                           'message' : 'error'})
       return jsonify({'success': True,
                       'currentCategory': None,
                       'categories' : categories,
-                      'totalQuestions' : len(formatted_questions),
+                      'totalQuestions' : total_questions,
                       'questions' : formatted_questions})
   '''
   -----------------------------------------------------------
@@ -262,7 +537,8 @@ def create_app(test_config=None):
   ***********************************************************
   Expected Inputs:
     quiz_category: Object.
-        The category user clicked to play the quiz
+        The category user clicked to play the quiz.
+        id 0 (or no id) plays across all categories.
     previous_questions: Object.
         List of id(s) of previously answered questions
   Expected Output:
@@ -270,7 +546,7 @@ def create_app(test_config=None):
     List of ids of previously answered questions
   ***********************************************************
   -----------------------------------------------------------
-  Linked tests:test_play
+  Linked tests:test_play, test_play_all_categories
   -----------------------------------------------------------
   '''
   @app.route('/quizzes', methods=['POST'])
@@ -280,23 +556,217 @@ def create_app(test_config=None):
           formatted_question = None
           previous_questions = request.get_json()['previous_questions']
           quiz_category = request.get_json()['quiz_category']
-          category_id = quiz_category['id']
-          questions = get_questions_by_category(category_id)
-          new_questions= subtract(questions, previous_questions)
-          if len(new_questions) > 0:
-              formatted_question = random.choice(new_questions).format()
+          category_id = quiz_category_id(quiz_category)
+          question = next_question(category_id, previous_questions)
+          if question is not None:
+              formatted_question = question.format(requested_fields(request))
       except Exception as e:
-          print(e)
+          app.logger.exception(e)
           return jsonify({'message': e})
       return jsonify({'success': True,
                       'previous_questions' : previous_questions,
                       'question' : formatted_question})
 
+  '''
+  -----------------------------------------------------------
+  This endpoint plays the adaptive quiz. The difficulty moves
+  one level up after a correct answer and one level down
+  after a wrong one, between 1 and 5.
+  -----------------------------------------------------------
+  ***********************************************************
+  Expected Inputs:
+    quiz_category: Object.
+        The category user clicked to play the quiz.
+        id 0 (or no id) plays across all categories.
+    previous_questions: Object.
+        List of id(s) of previously answered questions
+    difficulty: int, optional. Difficulty of the previous
+        question, as returned by the previous call. Default 3.
+    correct: bool, optional. Whether the previous question
+        was answered correctly. Omit it for the first question.
+        Anything but true, false or null is a 422.
+  Expected Output:
+    one question, at the new difficulty or the closest one
+    that still has questions
+    the difficulty of that question, to send back with the
+    next answer
+    List of ids of previously answered questions
+  ***********************************************************
+  -----------------------------------------------------------
+  Linked tests:test_play_adaptive, test_play_adaptive_422
+  -----------------------------------------------------------
+  '''
+  @app.route('/quizzes/adaptive', methods=['POST'])
+  def adaptive_quiz():
+      data = request.get_json(silent=True)
+      # correct must be a JSON boolean: the string "false" is truthy
+      if not isinstance(data, dict) or not isinstance(data.get('correct'), (bool, type(None))):
+          abort(422)
+      try:
+          difficulty = int(data.get('difficulty') or START_DIFFICULTY)
+      except (TypeError, ValueError, OverflowError):
+          abort(422)
+      try:
+          previous_questions = data['previous_questions']
+          category_id = quiz_category_id(data['quiz_category'])
+          difficulty = next_difficulty(difficulty, data.get('correct'))
+          question = pick_adaptive_question(category_id, previous_questions, difficulty)
+          if question is not None:
+              difficulty = question.difficulty
+      except Exception as e:
+          app.logger.exception(e)
+          abort(422)
+      return jsonify({'success': True,
+                      'previous_questions' : previous_questions,
+                      'difficulty' : difficulty,
+                      'question' : question.format(requested_fields(request)) if question is not None else None})
+
+  '''
+  -----------------------------------------------------------
+  These endpoints play the quiz with a server-side session.
+  The client starts a session once, then asks for the next
+  question with the session token only. The server remembers
+  which questions were already served.
+  -----------------------------------------------------------
+  ***********************************************************
+  Expected Inputs:
+    quiz_category: Object, when starting a session.
+        The category user clicked to play the quiz.
+        id 0 (or no id) plays across all categories.
+    token: string. Token returned when the session started.
+  Expected Output:
+    token and its time to live in seconds (start)
+    one question and the number of questions served (next)
+  ***********************************************************
+  -----------------------------------------------------------
+  Linked tests:test_play_session, test_play_session_404
+  -----------------------------------------------------------
+  '''
+  @app.route('/quizzes/sessions', methods=['POST'])
+  def start_quiz_session():
+      try:
+          quiz_category = (request.get_json() or {}).get('quiz_category')
+          token = quiz_sessions.start(quiz_category_id(quiz_category))
+      except Exception as e:
+          app.logger.exception(e)
+          abort(422)
+      return jsonify({'success': True,
+                      'token' : token,
+                      'expires_in' : SESSION_TTL})
+
+  @app.route('/quizzes/sessions/<token>/next', methods=['POST'])
+  def next_quiz_question(token):
+      session = quiz_sessions.get(token)
+      if session is None:
+          abort(404)
+      try:
+          formatted_question = None
+          question = session.next_question()
+          if question is not None:
+              formatted_question = question.format(requested_fields(request))
+      except Exception as e:
+          app.logger.exception(e)
+          return jsonify({'success': False,
+                          'message' : 'error'})
+      return jsonify({'success': True,
+                      'asked' : len(session.seen),
+                      'question' : formatted_question})
+
+  @app.route('/quizzes/sessions/<token>', methods=['DELETE'])
+  def end_quiz_session(token):
+      if not quiz_sessions.end(token):
+          abort(404)
+      return jsonify({'success': True})
+
+  '''
+  -----------------------------------------------------------
+  This endpoint reports connection pool usage, to help size
+  DB_POOL_SIZE and DB_MAX_OVERFLOW. Not exposed to end user.
+  -----------------------------------------------------------
+  ***********************************************************
+  Expected Inputs: None
+  Expected Output:
+    checkouts, timeouts and time spent waiting for a connection
+    pool size, connections in use and overflow (QueuePool only)
+  ***********************************************************
+  -----------------------------------------------------------
+  Linked tests:test_pool_stats
+  -----------------------------------------------------------
+  '''
+  @app.route('/metrics/pool', methods=['GET'])
+  def pool_metrics():
+      return jsonify({'success': True,
+                      'pool' : pool_stats()})
+
+  '''
+  -----------------------------------------------------------
+  This endpoint exposes request latency, SQL statement counts
+  and time, rows loaded and pool usage in Prometheus text
+  format, for scraping. Not exposed to end user.
+  -----------------------------------------------------------
+  ***********************************************************
+  Expected Inputs: None
+  Expected Output:
+    trivia_request_duration_seconds histogram per route
+    trivia_request_sql_statements histogram per route
+    trivia_request_sql_duration_seconds histogram per route
+    trivia_rows_loaded_total, trivia_requests_total counters
+    trivia_db_pool_* pool counters and gauges
+  ***********************************************************
+  -----------------------------------------------------------
+  Linked tests:test_metrics
+  -----------------------------------------------------------
+  '''
+  @app.route('/metrics', methods=['GET'])
+  def metrics():
+      return current_app.response_class(render_metrics(),
+                                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+  '''
+  -----------------------------------------------------------
+  This endpoint reports whether the worker is ready to serve,
+  for readiness probes. It sets up the database on its first
+  call (when no request did yet) and checks the connection.
+  Not exposed to end user.
+  -----------------------------------------------------------
+  ***********************************************************
+  Expected Inputs: None
+  Expected Output:
+    status: ready, or unavailable with a 503
+    startup: milliseconds spent in each phase of the start
+  ***********************************************************
+  -----------------------------------------------------------
+  Linked tests:test_healthz
+  -----------------------------------------------------------
+  '''
+  @app.route('/healthz', methods=['GET'])
+  def healthz():
+      try:
+          if not readiness.ensure():
+              raise readiness.error
+          db.session.execute(text('SELECT 1'))
+      except Exception as e:
+          app.logger.exception(e)
+          return jsonify({'success': False,
+                          'status' : 'unavailable',
+                          'startup' : readiness.timer.report()}), 503
+      return jsonify({'success': True,
+                      'status' : 'ready',
+                      'startup' : readiness.timer.report()})
+
   '''
   ***********************************************************
   Error Handler
   ***********************************************************
   '''
+  @app.errorhandler(503)
+  def unavailable(error):
+      return jsonify({
+             "success": False,
+             "error": 503,
+             "message": "service unavailable"
+         }), 503
+
   @app.errorhandler(500)
   def internal_server(error):
       return jsonify({
@@ -359,7 +829,7 @@ def create_app(test_config=None):
           category = Category(type=category_type)
           category.insert()
       except Exception as e:
-          print(e)
+          app.logger.exception(e)
           return jsonify({'success': False,
                           'message' : e.message})
       return jsonify({'success': True,
@@ -367,5 +837,7 @@ def create_app(test_config=None):
 
   '''***********************************************************
   '''
-
+  timer.mark('routes')
+  readiness = init_readiness(app, timer)
+  startup_log.info('app created in %.1f ms: %s', timer.total() * 1000, timer.format())
   return app
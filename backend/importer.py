@@ -0,0 +1,184 @@
+import csv
+import io
+import json
+import re
+from models import db, notify, bump_version, Question, Category
+
+# Rows inserted per transaction
+BATCH_SIZE = 1000
+
+# Per-row errors kept in the report; later ones are only counted.
+MAX_REPORTED_ERRORS = 100
+
+# Category values read as ids rather than names
+NUMBER = re.compile(r'^[-+]?(\d+(\.\d*)?|\.\d+)$')
+
+COPY_QUESTIONS = 'COPY questions (question, answer, difficulty, category) FROM STDIN WITH (FORMAT csv)'
+
+# Outcome of an import, updated after every batch.
+class ImportReport:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.error_count = 0
+        self.errors = []
+        self.categories_created = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'message': message})
+
+    def format(self):
+        return {
+          'read': self.read,
+          'inserted': self.inserted,
+          'errorCount': self.error_count,
+          'errors': self.errors,
+          'categoriesCreated': self.categories_created
+        }
+
+# Function to guess the format of an upload from its file name or
+# content type: csv, otherwise JSON Lines.
+def detect_format(name):
+    return 'csv' if name and 'csv' in name.lower() else 'jsonl'
+
+# Function to yield (line number, row dict) from a binary stream of
+# JSON Lines or CSV, one line at a time.
+def read_rows(stream, fmt):
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(text_stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            row = e
+        yield line_number, row
+
+# Resolves the category column of imported rows: an existing id, or a
+# category name that is created on first use. Numbers, and strings that
+# read as numbers, are always ids: they must be whole and not negative.
+class CategoryResolver:
+    def __init__(self, report):
+        self.report = report
+        self.ids = set()
+        self.names = {}
+        for category in Category.query.all():
+            self.ids.add(category.id)
+            self.names[category.type.lower()] = category.id
+
+    def resolve(self, value):
+        if isinstance(value, str):
+            value = value.strip()
+            if NUMBER.match(value):
+                value = float(value) if '.' in value else int(value)
+        if value is None or value == '':
+            raise ValueError('category is required')
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError('invalid category ' + json.dumps(value))
+        if not isinstance(value, str):
+            return self.resolve_id(value)
+        category_id = self.names.get(value.lower())
+        if category_id is None:
+            category = Category(type=value)
+            category.insert()
+            category_id = category.id
+            self.ids.add(category_id)
+            self.names[value.lower()] = category_id
+            self.report.categories_created.append(category.format())
+        return category_id
+
+    def resolve_id(self, value):
+        if value < 0 or (isinstance(value, float) and not value.is_integer()):
+            raise ValueError('invalid category id ' + str(value))
+        if int(value) not in self.ids:
+            raise ValueError('unknown category id ' + str(int(value)))
+        return int(value)
+
+# Function to return the (question, answer, difficulty, category) tuple
+# of a row, or raise ValueError describing what is wrong with it.
+def validate(row, categories):
+    if isinstance(row, Exception):
+        raise ValueError('invalid JSON: ' + str(row))
+    if not isinstance(row, dict):
+        raise ValueError('not a JSON object')
+    question = str(row.get('question') or '').strip()
+    answer = str(row.get('answer') or '').strip()
+    if not question or not answer:
+        raise ValueError('question and answer are required')
+    try:
+        difficulty = int(row.get('difficulty'))
+    except (TypeError, ValueError):
+        raise ValueError('difficulty must be an integer')
+    if not 1 <= difficulty <= 5:
+        raise ValueError('difficulty must be between 1 and 5')
+    return question, answer, difficulty, categories.resolve(row.get('category'))
+
+# Function to insert one batch in one transaction: COPY on Postgres,
+# a single executemany INSERT elsewhere. The 'questions' version is
+# bumped with it so other workers reload their counts.
+def insert_batch(rows):
+    connection = db.session.connection(clause=Question.__table__.insert())
+    if connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(COPY_QUESTIONS, buffer)
+    else:
+        connection.execute(Question.__table__.insert(), [
+            {'question': question, 'answer': answer, 'difficulty': difficulty, 'category': category}
+            for question, answer, difficulty, category in rows])
+    bump_version('questions')
+    db.session.commit()
+
+'''
+import_questions(stream, fmt)
+    streams questions from a binary JSON Lines or CSV stream into the
+    database, batch_size rows per transaction. Rows need question,
+    answer, difficulty (1-5) and category (id or name; unknown names
+    create the category). Invalid rows are reported and skipped.
+    on_progress, if given, is called with the report after each batch.
+'''
+def import_questions(stream, fmt='jsonl', batch_size=BATCH_SIZE, on_progress=None):
+    report = ImportReport()
+    categories = CategoryResolver(report)
+    batch = []
+    lines = []
+
+    def flush():
+        try:
+            insert_batch(batch)
+            report.inserted += len(batch)
+        except Exception as e:
+            db.session.rollback()
+            for line in lines:
+                report.add_error(line, 'batch failed: ' + str(e).splitlines()[0])
+        del batch[:]
+        del lines[:]
+        if on_progress is not None:
+            on_progress(report)
+
+    try:
+        for line, row in read_rows(stream, fmt):
+            report.read += 1
+            try:
+                batch.append(validate(row, categories))
+                lines.append(line)
+            except ValueError as e:
+                report.add_error(line, str(e))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    finally:
+        # Bulk inserts bypass Question.insert(): drop derived caches.
+        if report.inserted:
+            notify('reset', Question)
+    return report
@@ -1,44 +1,278 @@
 import os
+import json
+import time
+import hashlib
+from collections import defaultdict, namedtuple
 from flask import Flask, request, abort, jsonify, flash, current_app#, response
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import random
-from models import setup_db, Question, Category
+from sqlalchemy import func
+from sqlalchemy.orm import load_only
+from models import setup_db, db, on_change, current_version, pool_stats, Question, Category
+from serializers import requested_fields
+from store import load_question_store
+from question_index import QuestionIndex, page_ids
 
 # Number of questions each page could show
 QUESTIONS_PER_PAGE = 10
 
-# Function to return one page worth questions from the list.
-# Request provides the current page numnber.
-def paginate_questions(request, all_questions):
+# Seconds between two checks of a version counter in the database
+VERSION_CHECK_INTERVAL = 1.0
+
+# A value loaded from the database and kept in process until the
+# version counter stored next to the data moves. The counter is read at
+# most once per check_interval, so every worker picks up writes made by
+# the others without an outside cache service.
+class VersionedCache:
+    def __init__(self, name, loader, check_interval=VERSION_CHECK_INTERVAL):
+        self.name = name
+        self.loader = loader
+        self.check_interval = check_interval
+        self.version = None
+        self.value = None
+        self.checked_at = 0
+
+    def get(self):
+        now = time.monotonic()
+        if self.value is None or now - self.checked_at >= self.check_interval:
+            version = current_version(self.name)
+            self.checked_at = now
+            if self.value is None or version != self.version:
+                self.value = self.loader()
+                self.version = version
+        return self.value
+
+    def invalidate(self):
+        self.value = None
+
+    # Function to account for a write this process made and already
+    # applied to the value: the version it bumped needs no reload.
+    # Writes from other workers still move the counter past it.
+    def advance(self):
+        if self.version is not None:
+            self.version += 1
+
+# Function to return one page worth questions of a sorted id array
+# (see listed_ids). Request provides the current page number, or the id
+# of the last question already shown (after_id). The page is sliced
+# from the ids in O(log n) on any page, then only its questions are
+# read: from the question store, or with one primary key lookup. With
+# ?fields=, only those columns (plus id and category) are loaded and
+# returned.
+def paginate_questions(request, ids):
+    fields = requested_fields(request)
     page = request.args.get('page', 1, type=int)
-    start = (page -1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-    formatted_questions = [question.format() for question in all_questions]
-    sel_questions = formatted_questions[start:end]
-    return sel_questions
+    after_id = request.args.get('after_id', None, type=int)
+    return [question.format(fields)
+            for question in load_questions(page_ids(ids, page, after_id, QUESTIONS_PER_PAGE), fields)]
+
+# Function to return the questions of a list of ids, in its order.
+# Ids deleted since they were listed are skipped.
+def load_questions(ids, fields=None):
+    store = question_store()
+    if store is not None:
+        return store.get_many(ids)
+    if not ids:
+        return []
+    selection = Question.query.filter(Question.id.in_(list(ids)))
+    if fields is not None:
+        selection = selection.options(load_only(*set(fields) | {'id', 'category'}))
+    questions = {question.id: question for question in selection}
+    return [questions[question_id] for question_id in ids if question_id in questions]
+
+# Question counts per category and per (category, difficulty), so
+# totals are dictionary lookups instead of COUNT queries. Questions
+# without a category are counted under None.
+class QuestionStats:
+    def __init__(self, rows):
+        self.total = 0
+        self.categories = defaultdict(int)
+        self.difficulties = defaultdict(lambda: defaultdict(int))
+        for category_id, difficulty, count in rows:
+            self.add(category_id, difficulty, count)
+
+    def add(self, category_id, difficulty, count=1):
+        self.total += count
+        self.categories[category_id] += count
+        self.difficulties[category_id][difficulty] += count
+        if not self.difficulties[category_id][difficulty]:
+            del self.difficulties[category_id][difficulty]
+        if not self.categories[category_id]:
+            del self.categories[category_id]
+            del self.difficulties[category_id]
+
+    def count(self, category_id, difficulty=None):
+        if difficulty is None:
+            return self.categories.get(category_id, 0)
+        return self.difficulties.get(category_id, {}).get(difficulty, 0)
+
+    def format(self, category_id):
+        return {'total': self.count(category_id),
+                'difficulties': dict(self.difficulties.get(category_id, {}))}
+
+def _load_question_stats():
+    return QuestionStats(db.session.query(Question.category, Question.difficulty, func.count(Question.id))
+                         .group_by(Question.category, Question.difficulty))
+
+# In-process question statistics. Loaded with one GROUP BY, then
+# updated in place by Question.insert() and delete() here, and
+# reloaded when another worker bumps the 'questions' version.
+stats_cache = VersionedCache('questions', _load_question_stats)
+
+# Function to return the QuestionStats, loading them if needed.
+def question_stats():
+    return stats_cache.get()
+
+@on_change
+def _update_question_stats(action, record):
+    if action == 'reset' and record is Question:
+        stats_cache.invalidate()
+    elif isinstance(record, Question) and stats_cache.value is not None:
+        if action == 'update':
+            stats_cache.value.add(record.previous.category, record.previous.difficulty, -1)
+        stats_cache.value.add(record.category, record.difficulty, -1 if action == 'delete' else 1)
+        stats_cache.advance()
+
+# In-process question store, used when QUESTION_STORE is set. Loaded
+# with one query on first use, kept in step with Question.insert() and
+# delete() here through its change log, and reloaded when another worker
+# bumps the 'questions' version.
+store_cache = VersionedCache('questions', load_question_store)
+
+# Function to return the QuestionStore, or None when it is off
+def question_store():
+    if not current_app.extensions.get('trivia_question_store'):
+        return None
+    return store_cache.get()
+
+@on_change
+def _update_question_store(action, record):
+    if action == 'reset' and record is Question:
+        store_cache.invalidate()
+    elif isinstance(record, Question) and store_cache.value is not None:
+        store_cache.value.log_change(action, record)
+        store_cache.advance()
+
+# Function to return a question by id, or None. A StoredQuestion when
+# the question store is on, else a Question.
+def load_question(question_id):
+    store = question_store()
+    if store is None:
+        return Question.query.get(question_id)
+    return store.get(question_id)
+
+def _load_question_index():
+    return QuestionIndex(db.session.query(Question.id, Question.category, Question.difficulty))
+
+# In-process QuestionIndex of (id, category, difficulty), used by the
+# listings when the question store is off. Loaded with one query,
+# updated in place here, reloaded when another worker bumps 'questions'.
+index_cache = VersionedCache('questions', _load_question_index)
+
+# Function to return the question index: the one of the question store
+# when it is on, else the index of index_cache. Both have select().
+def question_index():
+    store = question_store()
+    if store is not None:
+        return store
+    return index_cache.get()
+
+@on_change
+def _update_question_index(action, record):
+    if action == 'reset' and record is Question:
+        index_cache.invalidate()
+    elif isinstance(record, Question) and index_cache.value is not None:
+        if action == 'delete':
+            index_cache.value.remove(record.id)
+        else:
+            # add() moves a question that is already indexed
+            index_cache.value.add(record.id, record.category, record.difficulty)
+        index_cache.advance()
+
+'''
+listed_ids(request, category_id=None)
+    returns the sorted ids of the questions a listing shows: those of
+    category_id (None for all), narrowed by the optional request
+    arguments difficulty (1 to 5) and search (a substring of the
+    question or answer, matched like POST /questions/search does).
+    Category and difficulty are one lookup in the question index; a
+    search costs its matches, not the size of the category.
+'''
+def listed_ids(request, category_id=None):
+    from search import matching_ids
+    difficulty = request.args.get('difficulty', None, type=int)
+    term = request.args.get('search', '').strip()
+    among = set(matching_ids(term)) if term else None
+    return question_index().select(category_id, difficulty, among)
+
+# Function to return the number of questions, from the question
+# statistics
+def count_questions():
+    return question_stats().total
+
+# Function to return the number of questions in a category
+def count_questions_in_category(category_id):
+    return question_stats().count(category_id)
+
+# Function to return the fields shared by the question listings:
+# one page of questions, their categories and the total.
+def questions_page(request, category_id=None):
+    ids = listed_ids(request, category_id)
+    formatted_questions = paginate_questions(request, ids)
+    return {'currentCategory': None,
+            'categories': compile_categories(formatted_questions),
+            'totalQuestions': len(ids),
+            'questions': formatted_questions}
+
+# Everything GET /categories needs: the id to type map, the
+# precomputed JSON body and its ETag.
+CategorySnapshot = namedtuple('CategorySnapshot', ['map', 'body', 'etag'])
+
+# Function to build a CategorySnapshot from (id, type) pairs in id order
+def category_snapshot(rows):
+    formatted_categories = {category_id: category_type for category_id, category_type in rows}
+    body = json.dumps({'success': True,
+                       'total': len(formatted_categories),
+                       'categories': formatted_categories}).encode('utf-8')
+    return CategorySnapshot(formatted_categories, body, hashlib.sha1(body).hexdigest())
+
+def _load_categories():
+    return category_snapshot(db.session.query(Category.id, Category.type).order_by(Category.id))
+
+# In-process category cache. Loaded on first use, reloaded after a
+# category is added or removed here, or when another worker bumps the
+# 'categories' version.
+category_cache = VersionedCache('categories', _load_categories)
+
+# Function to return the category map, loading it if needed.
+def category_map():
+    return category_cache.get().map
+
+@on_change
+def _reset_category_cache(action, record):
+    if record is Category or isinstance(record, Category):
+        category_cache.invalidate()
 
 # Function to return categories for questions that
 # will show on the current page ONLY.
+# Categories are served from the category map; ids it does not know
+# yet (added by another worker within the last version check) are
+# fetched in one IN (...) query.
 def compile_categories(formatted_questions):
-    categories={}
+    known = category_map()
+    categories = {}
+    missing = set()
     for question in formatted_questions:
-        category_id = question['category']
-        if category_id not in categories.keys():
-            category = Category.query.filter(Category.id == category_id).all()[0]
-            categories[category.id]=category.type
+        if question.get('category') is None:
+            continue
+        category_id = int(question['category'])
+        if category_id in known:
+            categories[category_id] = known[category_id]
+        else:
+            missing.add(category_id)
+    if missing:
+        for category in Category.query.filter(Category.id.in_(missing)).all():
+            categories[category.id] = category.type
     return categories
 
-# Function to return questions that match selected category_id
-def get_questions_by_category(category_id):
-    questions = Question.query.filter(Question.category == category_id).all()
-    return questions
-
-# Function to return differencial between two lists.
-def subtract(L1,L2):
-   L3=L1
-   for id in L2:
-       for question in L1:
-           if id == question.id:
-               L3.remove(question)
-   return L3
@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from models import db, pool_stats
+
+# Requests slower than this many milliseconds are logged with their
+# SQL statements. 0 disables the slow-request log.
+SLOW_REQUEST_MS = 500
+
+# Statements kept per request for the slow-request log
+MAX_LOGGED_STATEMENTS = 50
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+slow_log = logging.getLogger('trivia.slow')
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self.lock:
+            for label_values, (buckets, total, count) in sorted(self.series.items()):
+                labels = format_labels(self.labels, label_values)
+                for bound, bucket_count in zip(self.buckets, buckets):
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, labels, bound, bucket_count))
+                lines.append('%s_bucket{%s,le="+Inf"} %d' % (self.name, labels, count))
+                lines.append('%s_sum{%s} %s' % (self.name, labels, repr(total)))
+                lines.append('%s_count{%s} %d' % (self.name, labels, count))
+        return lines
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_values, value=1):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self.lock:
+            for label_values, value in sorted(self.series.items()):
+                lines.append('%s{%s} %s' % (self.name, format_labels(self.labels, label_values), value))
+        return lines
+
+def format_labels(names, values):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+request_duration = Histogram('trivia_request_duration_seconds',
+                             'Time spent handling a request.', ('route', 'method'), LATENCY_BUCKETS)
+request_statements = Histogram('trivia_request_sql_statements',
+                               'SQL statements issued per request.', ('route', 'method'), COUNT_BUCKETS)
+request_sql_duration = Histogram('trivia_request_sql_duration_seconds',
+                                 'Time spent in SQL per request.', ('route', 'method'), LATENCY_BUCKETS)
+rows_loaded = Counter('trivia_rows_loaded_total',
+                      'ORM rows loaded from the database.', ('route', 'method'))
+requests_total = Counter('trivia_requests_total',
+                         'Requests handled.', ('route', 'method', 'status'))
+
+REGISTRY = [request_duration, request_statements, request_sql_duration, rows_loaded, requests_total]
+
+# Optional per-module collectors: callables returning Prometheus lines,
+# by name, so registering again (a new app) replaces the old one.
+_collectors = {}
+
+def register_collector(collector):
+    _collectors[collector.__name__] = collector
+    return collector
+
+def _tracking():
+    return has_request_context() and 'metrics_start' in g
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if _tracking():
+        connection.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if not _tracking() or not connection.info.get('metrics_started'):
+        return
+    elapsed = time.perf_counter() - connection.info['metrics_started'].pop()
+    g.sql_count += 1
+    g.sql_time += elapsed
+    if len(g.sql_statements) < MAX_LOGGED_STATEMENTS:
+        g.sql_statements.append((elapsed, statement))
+
+def _on_load(target, context):
+    if _tracking():
+        g.rows_loaded += 1
+
+def route_label():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+'''
+init_metrics(app)
+    records latency, SQL statement counts and time, and ORM rows
+    loaded for every request. Each response carries a Server-Timing
+    header; render_metrics() returns the totals in Prometheus text
+    format. Requests slower than SLOW_REQUEST_MS (app.config or
+    environment) are logged to 'trivia.slow' with their statements.
+'''
+def init_metrics(app):
+    slow_request_ms = float(app.config.get('SLOW_REQUEST_MS', os.environ.get('SLOW_REQUEST_MS', SLOW_REQUEST_MS)))
+    for model in db.Model._decl_class_registry.values():
+        if isinstance(model, type) and issubclass(model, db.Model):
+            if not event.contains(model, 'load', _on_load):
+                event.listen(model, 'load', _on_load)
+
+    @app.before_request
+    def start_metrics():
+        g.metrics_start = time.perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0.0
+        g.sql_statements = []
+        g.rows_loaded = 0
+
+    @app.after_request
+    def record_metrics(response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        labels = (route_label(), request.method)
+        request_duration.observe(labels, elapsed)
+        request_statements.observe(labels, g.sql_count)
+        request_sql_duration.observe(labels, g.sql_time)
+        rows_loaded.inc(labels, g.rows_loaded)
+        requests_total.inc(labels + (response.status_code,))
+        response.headers.add('Server-Timing', 'app;dur=%.2f, db;dur=%.2f;desc="%d queries, %d rows"'
+                             % (elapsed * 1000, g.sql_time * 1000, g.sql_count, g.rows_loaded))
+        if slow_request_ms and elapsed * 1000 >= slow_request_ms:
+            slow_log.warning('%s %s took %.1f ms, %d queries (%.1f ms):\n%s',
+                             request.method, request.full_path, elapsed * 1000, g.sql_count,
+                             g.sql_time * 1000,
+                             '\n'.join('  %.1f ms  %s' % (duration * 1000, ' '.join(statement.split()))
+                                       for duration, statement in g.sql_statements))
+        return response
+
+# Function to return all metrics in Prometheus text format
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    stats = pool_stats()
+    for key, name in (('checkouts', 'trivia_db_pool_checkouts_total'),
+                      ('timeouts', 'trivia_db_pool_timeouts_total'),
+                      ('waitSecondsTotal', 'trivia_db_pool_wait_seconds_total'),
+                      ('waitSecondsMax', 'trivia_db_pool_wait_seconds_max'),
+                      ('size', 'trivia_db_pool_size'),
+                      ('checkedOut', 'trivia_db_pool_checked_out'),
+                      ('overflow', 'trivia_db_pool_overflow')):
+        if key in stats:
+            lines.append('%s %s' % (name, stats[key]))
+    for collector in _collectors.values():
+        lines.extend(collector())
+    return '\n'.join(lines) + '\n'
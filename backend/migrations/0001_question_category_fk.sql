@@ -0,0 +1,30 @@
+--
+-- Make questions.category an integer foreign key to categories.id and
+-- index (category, id). Databases restored from trivia.psql already
+-- have an integer column; databases created by db.create_all() before
+-- this change have a text column. The script handles both and can be
+-- run more than once:
+--
+--   psql trivia < migrations/0001_question_category_fk.sql
+--
+
+BEGIN;
+
+ALTER TABLE public.questions
+    ALTER COLUMN category TYPE integer USING NULLIF(trim(category::text), '')::integer;
+
+-- Questions pointing to a category that does not exist lose their category,
+-- as they would have if it had been deleted.
+UPDATE public.questions SET category = NULL
+    WHERE category IS NOT NULL
+      AND category NOT IN (SELECT id FROM public.categories);
+
+ALTER TABLE public.questions DROP CONSTRAINT IF EXISTS category;
+ALTER TABLE public.questions
+    ADD CONSTRAINT category FOREIGN KEY (category) REFERENCES public.categories(id) ON UPDATE CASCADE ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_id ON public.questions USING btree (category, id);
+
+ANALYZE public.questions;
+
+COMMIT;
@@ -0,0 +1,22 @@
+--
+-- Create the versions table: one counter per data set ('questions',
+-- 'categories'), bumped by every write to it, which workers compare
+-- against to reload their caches. db.create_all() creates it; databases
+-- restored from trivia.psql before it was added, or managed with
+-- DB_CREATE_ALL=false, need this script. It can be run more than once:
+--
+--   psql trivia < migrations/0002_versions.sql
+--
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.versions (
+    name character varying NOT NULL,
+    value integer NOT NULL,
+    CONSTRAINT versions_pkey PRIMARY KEY (name)
+);
+
+INSERT INTO public.versions (name, value) VALUES ('questions', 0), ('categories', 0)
+    ON CONFLICT (name) DO NOTHING;
+
+COMMIT;
@@ -0,0 +1,16 @@
+--
+-- Create the pg_trgm extension and the trigram GIN indexes that let
+-- searches (ILIKE '%term%' on question and answer) use an index instead
+-- of scanning the table. Creating the extension needs a role allowed to
+-- (usually the database owner or a superuser). Workers check for the
+-- indexes at startup and search with an in-process index until they
+-- exist. The script can be run more than once:
+--
+--   psql trivia < migrations/0003_search_trigram.sql
+--
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_questions_question_trgm ON public.questions USING gin (question gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm ON public.questions USING gin (answer gin_trgm_ops);
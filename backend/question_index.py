@@ -0,0 +1,123 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+# Category key of questions without a category
+NO_CATEGORY = -1
+
+'''
+QuestionIndex
+    sorted id arrays of every question, of each category and of each
+    (category, difficulty), plus an id -> row map. Rows are whatever
+    the owner stores with the id (a slot of the QuestionStore, or
+    None). Adding or removing a question is a bisect and one shift of
+    each of its three arrays; reading an id array is a dict lookup.
+'''
+class QuestionIndex:
+    def __init__(self, rows=()):
+        self.rows = {}
+        self.ids = array('l')
+        self.category_ids = {}
+        self.difficulty_ids = {}
+        for question_id, category, difficulty in rows:
+            self.add(question_id, category, difficulty)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, question_id):
+        return question_id in self.rows
+
+    def add(self, question_id, category, difficulty, row=None):
+        if question_id in self.rows:
+            self.remove(question_id)
+        category = NO_CATEGORY if category is None else int(category)
+        self.rows[question_id] = (category, difficulty, row)
+        for ids in self._arrays(category, difficulty, create=True):
+            insort(ids, question_id)
+
+    # Function to drop a question, returning its row (None if unknown)
+    def remove(self, question_id):
+        entry = self.rows.pop(question_id, None)
+        if entry is None:
+            return None
+        category, difficulty, row = entry
+        for ids in self._arrays(category, difficulty):
+            remove(ids, question_id)
+        if not self.category_ids[category]:
+            del self.category_ids[category]
+        if not self.difficulty_ids[category, difficulty]:
+            del self.difficulty_ids[category, difficulty]
+        return row
+
+    def _arrays(self, category, difficulty, create=False):
+        if create:
+            return (self.ids, self.category_ids.setdefault(category, array('l')),
+                    self.difficulty_ids.setdefault((category, difficulty), array('l')))
+        return (self.ids, self.category_ids[category], self.difficulty_ids[category, difficulty])
+
+    # Function to return the row stored with an id, or None
+    def get(self, question_id):
+        entry = self.rows.get(question_id)
+        return entry[2] if entry is not None else None
+
+    '''
+    select(category_id=None, difficulty=None, among=None)
+        returns the sorted ids of the questions of a category (None
+        for all of them) and difficulty (None for any). Without among
+        this is a dict lookup, O(1). among narrows the result to a
+        set of ids, such as the matches of a text search. The smaller
+        side is walked: the n ids of the category and difficulty are
+        checked against among, O(n), or the m ids of among against the
+        row map, O(m log m), whichever is fewer.
+    '''
+    def select(self, category_id=None, difficulty=None, among=None):
+        ids = self._select(category_id, difficulty)
+        if among is None:
+            return ids
+        if len(ids) <= len(among):
+            return array('l', (question_id for question_id in ids if question_id in among))
+        category = None if category_id is None else int(category_id)
+        return array('l', sorted(
+            question_id for question_id in among
+            if question_id in self.rows
+            and (category is None or self.rows[question_id][0] == category)
+            and (difficulty is None or self.rows[question_id][1] == difficulty)))
+
+    def _select(self, category_id, difficulty):
+        if category_id is None and difficulty is None:
+            return self.ids
+        if difficulty is None:
+            return self.category_ids.get(int(category_id), array('l'))
+        if category_id is None:
+            return merge([ids for (category, level), ids in self.difficulty_ids.items()
+                          if level == difficulty])
+        return self.difficulty_ids.get((int(category_id), difficulty), array('l'))
+
+# Function to insert an id into a sorted array. Appending, the usual
+# case for new questions, skips the search.
+def insort(ids, question_id):
+    if not ids or ids[-1] < question_id:
+        ids.append(question_id)
+    else:
+        ids.insert(bisect_left(ids, question_id), question_id)
+
+def remove(ids, question_id):
+    position = bisect_left(ids, question_id)
+    if position < len(ids) and ids[position] == question_id:
+        del ids[position]
+
+# Function to merge disjoint sorted id arrays into one
+def merge(arrays):
+    if len(arrays) == 1:
+        return arrays[0]
+    return array('l', sorted(question_id for ids in arrays for question_id in ids))
+
+'''
+page_ids(ids, page=1, after_id=None, per_page=10)
+    returns one page of a sorted id array: page number page, an
+    offset, or the page after the id after_id, a bisect. O(log n)
+    plus the per_page ids copied, on any page.
+'''
+def page_ids(ids, page=1, after_id=None, per_page=10):
+    start = bisect_right(ids, after_id) if after_id is not None else (max(page, 1) - 1) * per_page
+    return ids[start:start + per_page]
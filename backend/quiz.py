@@ -0,0 +1,280 @@
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from models import db, on_change, Question
+from lib import VersionedCache, load_question, category_map
+
+# Pool key used for "all categories"
+ALL_CATEGORIES = 0
+
+# Random draws tried before falling back to a scan of the pool.
+MAX_DRAWS = 8
+
+# Seconds a quiz session lives after its last use
+SESSION_TTL = 30 * 60
+
+# Most quiz sessions kept in memory; the least recently used go first.
+MAX_SESSIONS = 10000
+
+# Difficulty range of the adaptive quiz, and where it starts
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+START_DIFFICULTY = 3
+
+# Ids of the questions in one category (or all of them), kept in a list
+# plus an id -> position map so that add, remove and sample are O(1).
+class IdPool:
+    def __init__(self, ids):
+        self.ids = list(ids)
+        self.positions = {question_id: i for i, question_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, question_id):
+        if question_id not in self.positions:
+            self.positions[question_id] = len(self.ids)
+            self.ids.append(question_id)
+
+    def remove(self, question_id):
+        position = self.positions.pop(question_id, None)
+        if position is None:
+            return
+        last = self.ids.pop()
+        if last != question_id:
+            self.ids[position] = last
+            self.positions[last] = position
+
+    # Function to return a random id that is not in exclude (a set),
+    # or None when every id has been seen. Random draws are expected
+    # O(1) while most ids are unseen; the scan only runs near the end.
+    def sample(self, exclude):
+        if not self.ids:
+            return None
+        for _ in range(MAX_DRAWS):
+            question_id = random.choice(self.ids)
+            if question_id not in exclude:
+                return question_id
+        remaining = [question_id for question_id in self.ids if question_id not in exclude]
+        return random.choice(remaining) if remaining else None
+
+# Id pools and difficulty buckets per category id, each in a
+# VersionedCache of the 'questions' version: writes of this process
+# update them in place (see _update_pools), those of other workers make
+# them reload. Only ids of existing categories and ALL_CATEGORIES get
+# an entry, so ids sent by clients cannot grow them.
+_pools = {}
+_buckets = {}
+
+# Function to return the cache of category_id in caches, adding one
+# that loads with loader(category_id) when the id is ALL_CATEGORIES or
+# in categories (ids of existing categories). None for other ids.
+def category_cache(caches, category_id, categories, loader):
+    cache = caches.get(category_id)
+    if cache is None and (category_id == ALL_CATEGORIES or category_id in categories):
+        cache = caches[category_id] = VersionedCache('questions', lambda: loader(category_id))
+    return cache
+
+# Function to load the id pool of a category with a single id-only query
+def load_pool(category_id):
+    selection = db.session.query(Question.id)
+    if category_id != ALL_CATEGORIES:
+        selection = selection.filter(Question.category == category_id)
+    return IdPool(question_id for question_id, in selection)
+
+# Function to return the id pool for a category. Pools of ids that are
+# not categories are loaded for the request and not kept.
+def get_pool(category_id):
+    cache = _pools.get(category_id) or category_cache(_pools, category_id, category_map(), load_pool)
+    return cache.get() if cache is not None else load_pool(category_id)
+
+# Id pools of one category (or all of them) per difficulty, loaded
+# together with a single (id, difficulty) query.
+class DifficultyBuckets:
+    def __init__(self, rows):
+        self.pools = {}
+        for question_id, difficulty in rows:
+            self.add(question_id, difficulty)
+
+    def add(self, question_id, difficulty):
+        pool = self.pools.get(difficulty)
+        if pool is None:
+            pool = self.pools[difficulty] = IdPool(())
+        pool.add(question_id)
+
+    def remove(self, question_id, difficulty):
+        pool = self.pools.get(difficulty)
+        if pool is not None:
+            pool.remove(question_id)
+
+# Function to load the difficulty buckets of a category with a single
+# (id, difficulty) query
+def load_buckets(category_id):
+    selection = db.session.query(Question.id, Question.difficulty)
+    if category_id != ALL_CATEGORIES:
+        selection = selection.filter(Question.category == category_id)
+    return DifficultyBuckets(selection)
+
+# Function to return the difficulty buckets of a category, kept like
+# the id pools.
+def get_buckets(category_id):
+    cache = _buckets.get(category_id) or category_cache(_buckets, category_id, category_map(), load_buckets)
+    return cache.get() if cache is not None else load_buckets(category_id)
+
+@on_change
+def _update_pools(action, record):
+    if action == 'reset' and record is Question:
+        _pools.clear()
+        _buckets.clear()
+        return
+    if not isinstance(record, Question):
+        return
+    if action == 'update':
+        _apply_change('delete', record.previous)
+        _apply_change('insert', record)
+    else:
+        _apply_change(action, record)
+    # Every pool is up to date with this write, including those of
+    # other categories, which it did not touch
+    for cache in list(_pools.values()) + list(_buckets.values()):
+        cache.advance()
+
+def _apply_change(action, record):
+    keys = [ALL_CATEGORIES]
+    if record.category is not None:
+        keys.append(int(record.category))
+    for key in keys:
+        pool = _pools[key].value if key in _pools else None
+        buckets = _buckets[key].value if key in _buckets else None
+        if action == 'insert':
+            if pool is not None:
+                pool.add(record.id)
+            if buckets is not None:
+                buckets.add(record.id, record.difficulty)
+        elif action == 'delete':
+            if pool is not None:
+                pool.remove(record.id)
+            if buckets is not None:
+                buckets.remove(record.id, record.difficulty)
+
+# Function to return the category id of a quiz_category object sent
+# by the client. Anything without an id (the "ALL" button) or id 0
+# means all categories.
+def quiz_category_id(quiz_category):
+    if isinstance(quiz_category, dict):
+        return int(quiz_category.get('id') or ALL_CATEGORIES)
+    return ALL_CATEGORIES
+
+# Function to return a random question of the category that is not in
+# previous_ids, or None when the category is exhausted. Only the
+# chosen question is loaded from the database.
+def next_question(category_id, previous_ids):
+    exclude = set(int(question_id) for question_id in previous_ids)
+    return pick_question(category_id, exclude)
+
+# Same as next_question, for callers that already hold a set of ids.
+def pick_question(category_id, exclude):
+    return draw_question(get_pool(category_id), exclude)
+
+# Function to load a random question of pool that is not in exclude,
+# or return None when there is none left.
+def draw_question(pool, exclude):
+    while True:
+        question_id = pool.sample(exclude)
+        if question_id is None:
+            return None
+        question = load_question(question_id)
+        if question is not None:
+            return question
+        # Deleted by another worker since the pool was loaded
+        pool.remove(question_id)
+
+# Function to return the difficulty of the next adaptive question:
+# one level up after a correct answer, one down after a wrong one,
+# unchanged when the client reports nothing.
+def next_difficulty(difficulty, correct):
+    if correct is not None:
+        difficulty += 1 if correct else -1
+    return max(MIN_DIFFICULTY, min(MAX_DIFFICULTY, difficulty))
+
+'''
+pick_adaptive_question(category_id, previous_ids, difficulty)
+    returns a random unseen question of the category at the given
+    difficulty, or at the closest difficulty that still has one
+    (harder first on ties), or None when the category is exhausted.
+    Served from the in-memory difficulty buckets: each step tries at
+    most MAX_DIFFICULTY levels, whatever the size of the category.
+'''
+def pick_adaptive_question(category_id, previous_ids, difficulty):
+    exclude = set(int(question_id) for question_id in previous_ids)
+    buckets = get_buckets(category_id)
+    for distance in range(MAX_DIFFICULTY - MIN_DIFFICULTY + 1):
+        levels = (difficulty + distance, difficulty - distance) if distance else (difficulty,)
+        for level in levels:
+            pool = buckets.pools.get(level)
+            question = draw_question(pool, exclude) if pool is not None else None
+            if question is not None:
+                return question
+    return None
+
+# State of one quiz game: its category and the ids already served.
+# Quizzes are short, so the set of seen ids stays small no matter how
+# large the category is.
+class QuizSession:
+    __slots__ = ('category_id', 'seen', 'last_used')
+
+    def __init__(self, category_id):
+        self.category_id = category_id
+        self.seen = set()
+        self.last_used = time.monotonic()
+
+    def next_question(self):
+        question = pick_question(self.category_id, self.seen)
+        if question is not None:
+            self.seen.add(question.id)
+        return question
+
+# In-process quiz sessions keyed by token, in least recently used
+# order. Sessions idle for longer than ttl, and the oldest ones beyond
+# max_sessions, are evicted.
+class QuizSessionStore:
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def start(self, category_id):
+        token = secrets.token_urlsafe(16)
+        with self.lock:
+            self.sessions[token] = QuizSession(category_id)
+            self._evict(time.monotonic())
+        return token
+
+    def get(self, token):
+        now = time.monotonic()
+        with self.lock:
+            self._evict(now)
+            session = self.sessions.get(token)
+            if session is not None:
+                session.last_used = now
+                self.sessions.move_to_end(token)
+        return session
+
+    def end(self, token):
+        with self.lock:
+            return self.sessions.pop(token, None) is not None
+
+    def _evict(self, now):
+        while self.sessions:
+            oldest = next(iter(self.sessions.values()))
+            if len(self.sessions) <= self.max_sessions and now - oldest.last_used <= self.ttl:
+                break
+            self.sessions.popitem(last=False)
+
+quiz_sessions = QuizSessionStore()
@@ -0,0 +1,123 @@
+import itertools
+import threading
+import time
+from flask import g, request, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
+
+# Seconds a client keeps reading from the primary after it wrote, so it
+# sees its own writes while the replicas catch up.
+STICKY_SECONDS = 5
+
+# Cookie carrying the end of the stickiness window
+STICKY_COOKIE = 'trivia_primary_until'
+
+# Seconds a replica that failed is left out before it is tried again
+RETRY_SECONDS = 10
+
+# Pool of read-only replica engines, used round-robin. A replica whose
+# connection fails is marked down for RETRY_SECONDS, then pinged before
+# it gets traffic again.
+class ReplicaSet:
+    def __init__(self, engines):
+        self.engines = list(engines)
+        self.down_until = {}
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        for engine in self.engines:
+            event.listen(engine, 'handle_error', self._on_error)
+
+    def __len__(self):
+        return len(self.engines)
+
+    def _on_error(self, context):
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+    def mark_down(self, engine):
+        with self.lock:
+            self.down_until[engine] = time.monotonic() + RETRY_SECONDS
+
+    def is_up(self, engine):
+        down_until = self.down_until.get(engine)
+        if down_until is None:
+            return True
+        if time.monotonic() < down_until:
+            return False
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except Exception:
+            self.mark_down(engine)
+            return False
+        with self.lock:
+            self.down_until.pop(engine, None)
+        return True
+
+    # Function to return the next healthy replica, or None
+    def pick(self):
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self.counter) % len(self.engines)]
+            if self.is_up(engine):
+                return engine
+        return None
+
+    def status(self):
+        now = time.monotonic()
+        return [{'url': repr(engine.url), 'up': self.down_until.get(engine, 0) <= now}
+                for engine in self.engines]
+
+# Function to tell whether the current request must read from the
+# primary: it wrote already, or its client wrote a moment ago.
+def use_primary():
+    return g.get('trivia_primary', False)
+
+def mark_write():
+    if has_request_context():
+        g.trivia_primary = True
+        g.trivia_wrote = True
+
+'''
+RoutingSession
+    sends INSERT/UPDATE/DELETE and flushes to the primary, and reads
+    made while handling a request to a replica. Reads outside a
+    request (CLI, background work) stay on the primary.
+'''
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        primary = SignallingSession.get_bind(self, mapper, clause)
+        if self._flushing or isinstance(clause, UpdateBase):
+            mark_write()
+            return primary
+        replicas = self.app.extensions.get('trivia_replicas')
+        if not replicas or not has_request_context() or use_primary():
+            return primary
+        return replicas.pick() or primary
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    '''
+    init_replicas(app, uris, options_for)
+        creates one engine per replica URI, with the engine options
+        options_for(uri) returns, and installs the request hooks that
+        keep a client on the primary right after it wrote.
+    '''
+    def init_replicas(self, app, uris, options_for):
+        engines = [create_engine(uri, **options_for(uri)) for uri in uris]
+        app.extensions['trivia_replicas'] = ReplicaSet(engines)
+
+        @app.before_request
+        def route_sticky_client():
+            until = request.cookies.get(STICKY_COOKIE, 0, type=float)
+            g.trivia_primary = until > time.time()
+
+        @app.after_request
+        def remember_write(response):
+            if g.get('trivia_wrote'):
+                response.set_cookie(STICKY_COOKIE, str(time.time() + STICKY_SECONDS),
+                                    max_age=STICKY_SECONDS, httponly=True)
+            return response
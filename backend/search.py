@@ -0,0 +1,157 @@
+import logging
+import time
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import case, or_, text
+from models import db, on_change, Question
+from lib import QUESTIONS_PER_PAGE
+
+# Seconds the in-process index is trusted before it is rebuilt, so that
+# questions written by other workers become searchable in this one.
+INDEX_TTL = 60
+
+search_log = logging.getLogger('trivia.search')
+
+# Postgres: trigram GIN indexes let ILIKE '%term%' use an index instead
+# of scanning the table. They are maintained by Postgres on every
+# insert, update and delete, and created by
+# migrations/0003_search_trigram.sql.
+TRIGRAM_INDEXES = ('ix_questions_question_trgm', 'ix_questions_answer_trgm')
+
+'''
+setup_search_index()
+    checks for the trigram indexes when the database is Postgres and
+    records whether the app can search with them. Without them (the
+    migration was not applied) a warning is logged and searches use
+    the in-process InvertedIndex, as on other databases.
+'''
+def setup_search_index():
+    found = False
+    if db.engine.dialect.name == 'postgresql':
+        rows = db.session.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'questions'"))
+        missing = set(TRIGRAM_INDEXES) - set(name for name, in rows)
+        found = not missing
+        if missing:
+            search_log.warning('trigram indexes %s are missing, searching in process: '
+                               'apply migrations/0003_search_trigram.sql', ', '.join(sorted(missing)))
+    current_app.extensions['trivia_trigram_search'] = found
+
+# Function to return whether the app searches with the trigram
+# indexes of the database
+def database_search():
+    return current_app.extensions.get('trivia_trigram_search', False)
+
+# Function to return the trigrams of a lower-cased string
+def trigrams(value):
+    return set(value[i:i + 3] for i in range(len(value) - 2))
+
+# In-process inverted index from trigram to question ids, used when the
+# database has no trigram support (SQLite in tests). A term matches a
+# question when it is a substring of its question or answer, exactly
+# like ILIKE '%term%'.
+class InvertedIndex:
+    def __init__(self, rows):
+        self.texts = {}
+        self.postings = defaultdict(set)
+        self.loaded_at = time.monotonic()
+        for question_id, question, answer in rows:
+            self.add(question_id, question, answer)
+
+    def add(self, question_id, question, answer):
+        texts = ((question or '').lower(), (answer or '').lower())
+        self.texts[question_id] = texts
+        for gram in trigrams(texts[0]) | trigrams(texts[1]):
+            self.postings[gram].add(question_id)
+
+    def remove(self, question_id):
+        texts = self.texts.pop(question_id, None)
+        if texts is None:
+            return
+        for gram in trigrams(texts[0]) | trigrams(texts[1]):
+            self.postings[gram].discard(question_id)
+
+    # Function to return the matching ids, best ranked first
+    def search(self, term):
+        term = term.lower()
+        grams = trigrams(term)
+        if grams:
+            sets = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*sets)
+        else:
+            candidates = self.texts.keys()
+        matches = []
+        for question_id in candidates:
+            question, answer = self.texts[question_id]
+            score = rank(term in question, term in answer)
+            if score:
+                matches.append((-score, question_id))
+        matches.sort()
+        return [question_id for score, question_id in matches]
+
+# Ranking shared by both backends: a match in the question beats a
+# match in the answer only; ties are broken by id.
+def rank(in_question, in_answer):
+    return 2 * in_question + in_answer
+
+_index = None
+
+def get_index():
+    global _index
+    if _index is None or time.monotonic() - _index.loaded_at > INDEX_TTL:
+        rows = db.session.query(Question.id, Question.question, Question.answer)
+        _index = InvertedIndex(rows)
+    return _index
+
+@on_change
+def _update_index(action, record):
+    global _index
+    if action == 'reset' and record is Question:
+        _index = None
+        return
+    if _index is None or not isinstance(record, Question):
+        return
+    if action in ('update', 'delete'):
+        _index.remove(record.id)
+    if action in ('insert', 'update'):
+        _index.add(record.id, record.question, record.answer)
+
+def _escape_like(term):
+    return term.replace('/', '//').replace('%', '/%').replace('_', '/_')
+
+# Function to return the ILIKE conditions of a search, on the question
+# and on the answer
+def _match_conditions(term):
+    pattern = '%' + _escape_like(term) + '%'
+    return Question.question.ilike(pattern, escape='/'), Question.answer.ilike(pattern, escape='/')
+
+# Function to return the ids of the questions whose question or answer
+# contains term, in no particular order: from the database when it
+# searches with trigram indexes, else from the in-process index.
+def matching_ids(term):
+    if database_search():
+        return [question_id for question_id, in
+                db.session.query(Question.id).filter(or_(*_match_conditions(term)))]
+    return get_index().search(term)
+
+# Function to return one page of questions whose question or answer
+# contains term, best ranked first, and the total number of matches.
+# The total is counted by the database (or the index); only the page
+# is loaded and formatted, with only the given fields if any.
+def find_questions(term, page=1, fields=None):
+    start = (max(page, 1) - 1) * QUESTIONS_PER_PAGE
+    if database_search():
+        in_question, in_answer = _match_conditions(term)
+        selection = Question.query.filter(or_(in_question, in_answer))
+        total = selection.count()
+        score = case([(in_question, 2)], else_=0) + case([(in_answer, 1)], else_=0)
+        questions = selection.order_by(score.desc(), Question.id) \
+            .offset(start).limit(QUESTIONS_PER_PAGE).all()
+    else:
+        matches = get_index().search(term)
+        total = len(matches)
+        page_ids = matches[start:start + QUESTIONS_PER_PAGE]
+        rows = {question.id: question
+                for question in Question.query.filter(Question.id.in_(page_ids)).all()}
+        questions = [rows[question_id] for question_id in page_ids if question_id in rows]
+    return [question.format(fields) for question in questions], total
@@ -0,0 +1,114 @@
+import gzip
+import json
+from flask import current_app, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this many bytes are sent uncompressed:
+# compressing them costs more CPU than it saves on the wire.
+COMPRESS_MIN_SIZE = 1024
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/csv', 'text/html')
+
+# Fields a client may select with ?fields=
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+def _dumps_json(obj, sort_keys):
+    return json.dumps(obj, cls=current_app.json_encoder, sort_keys=sort_keys,
+                      separators=(',', ':')).encode('utf-8')
+
+def _dumps_orjson(obj, sort_keys):
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return orjson.dumps(obj, option=option)
+
+# Serializers by name. JSON_SERIALIZER in app.config picks one;
+# the default is orjson when it is installed.
+SERIALIZERS = {'json': _dumps_json}
+if orjson is not None:
+    SERIALIZERS['orjson'] = _dumps_orjson
+
+# Function to return obj as compact JSON bytes, with the configured
+# serializer
+def dumps(obj):
+    name = current_app.config.get('JSON_SERIALIZER') or ('orjson' if orjson is not None else 'json')
+    return SERIALIZERS[name](obj, current_app.config.get('JSON_SORT_KEYS', True))
+
+'''
+jsonify(obj)
+    drop-in replacement for flask.jsonify (one dict argument)
+    that serializes with dumps().
+'''
+def jsonify(obj):
+    return current_app.response_class(dumps(obj) + b'\n', mimetype='application/json')
+
+# Function to return the question fields selected with ?fields=id,...
+# in QUESTION_FIELDS order, or None when all of them are wanted.
+# Unknown names are ignored.
+def requested_fields(request):
+    value = request.args.get('fields')
+    if not value:
+        return None
+    selected = set(field.strip() for field in value.split(','))
+    fields = [field for field in QUESTION_FIELDS if field in selected]
+    return fields or None
+
+# Function to return the codings of an Accept-Encoding header that
+# the client accepts (q > 0)
+def accepted_encodings(header):
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+# Function to compress a response body in place with the best coding
+# the client accepts: br when brotli is installed, else gzip.
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    min_size = current_app.config.get('COMPRESS_MIN_SIZE', COMPRESS_MIN_SIZE)
+    if response.content_length is not None and response.content_length < min_size:
+        return response
+    response.vary.add('Accept-Encoding')
+    accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    if brotli is not None and 'br' in accepted:
+        coding, compress = 'br', lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+    elif 'gzip' in accepted:
+        coding, compress = 'gzip', lambda data: gzip.compress(data, GZIP_LEVEL)
+    else:
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    response.set_data(compress(data))
+    response.headers['Content-Encoding'] = coding
+    return response
+
+'''
+init_compression(app)
+    compresses JSON and text responses of COMPRESS_MIN_SIZE bytes or
+    more, negotiated with Accept-Encoding. Streamed responses (the
+    export) and 304s are left alone.
+'''
+def init_compression(app):
+    app.after_request(compress_response)
@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+import time
+from flask import abort, request
+from sqlalchemy import inspect
+from models import db, db_setting
+from search import setup_search_index
+from lib import store_cache
+from metrics import register_collector, format_labels
+
+startup_log = logging.getLogger('trivia.startup')
+
+# Endpoints served before the database is set up: probes and scrapes
+EXEMPT_ENDPOINTS = ('healthz', 'metrics')
+
+# Key generated when SECRET_KEY is not configured. One per process:
+# workers started without SECRET_KEY do not share it.
+_generated_secret_key = None
+
+'''
+secret_key(config)
+    returns SECRET_KEY from app.config, then from the environment.
+    Without one, a random key is generated once per process and a
+    warning is logged, as workers then sign with different keys.
+'''
+def secret_key(config):
+    global _generated_secret_key
+    key = config.get('SECRET_KEY') or os.environ.get('SECRET_KEY')
+    if key:
+        return key
+    if _generated_secret_key is None:
+        startup_log.warning('SECRET_KEY is not set; using a random key for this process only')
+        _generated_secret_key = os.urandom(32)
+    return _generated_secret_key
+
+'''
+StartupTimer
+    durations of the phases of a worker's start, in order. mark(name)
+    records the time since the previous mark (or since the timer was
+    created) as phase name.
+'''
+class StartupTimer:
+    def __init__(self):
+        self.phases = []
+        self.last = time.perf_counter()
+
+    def record(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.record(name, now - self.last)
+        self.last = now
+
+    def total(self):
+        return sum(seconds for name, seconds in self.phases)
+
+    def report(self):
+        return {name: round(seconds * 1000, 3) for name, seconds in self.phases}
+
+    def format(self):
+        return ', '.join('%s %.1f ms' % (name, seconds * 1000) for name, seconds in self.phases)
+
+# Function to return the names of the tables of the models that are
+# missing from the database, sorted
+def missing_tables():
+    existing = set(inspect(db.engine).get_table_names())
+    return sorted(set(db.metadata.tables) - existing)
+
+# Function to create the missing tables (when DB_CREATE_ALL is set),
+# check for the search indexes, then load the question store when it is
+# on. Fails when a table the routes need is still missing.
+def prepare_database(app):
+    with app.app_context():
+        if db_setting(app.config, 'DB_CREATE_ALL'):
+            db.create_all()
+        missing = missing_tables()
+        if missing:
+            raise RuntimeError('missing tables %s: apply trivia.psql and migrations/'
+                               % ', '.join(missing))
+        setup_search_index()
+        if app.extensions.get('trivia_question_store'):
+            store_cache.get()
+
+'''
+Readiness
+    runs prepare_database once, on the first call to ensure(), and
+    remembers the outcome. A failed attempt is retried by the next
+    call, so a worker started before its database recovers on its own.
+'''
+class Readiness:
+    def __init__(self, app, timer):
+        self.app = app
+        self.timer = timer
+        self.ready = False
+        self.error = None
+        self.lock = threading.Lock()
+
+    def ensure(self):
+        if self.ready:
+            return True
+        with self.lock:
+            if self.ready:
+                return True
+            started = time.perf_counter()
+            try:
+                prepare_database(self.app)
+            except Exception as e:
+                self.error = e
+                startup_log.exception('database setup failed')
+                return False
+            self.timer.record('database', time.perf_counter() - started)
+            self.ready = True
+            self.error = None
+        startup_log.info('ready in %.1f ms: %s', self.timer.total() * 1000, self.timer.format())
+        return True
+
+'''
+init_readiness(app, timer)
+    defers the database setup of the app to its first request (or
+    to /healthz, for readiness probes). With DB_LAZY_SETUP false it
+    runs right away, as create_app used to. Requests that arrive
+    while the database cannot be set up get a 503.
+'''
+def init_readiness(app, timer):
+    readiness = Readiness(app, timer)
+    app.extensions['trivia_readiness'] = readiness
+
+    @app.before_request
+    def ensure_ready():
+        if request.endpoint in EXEMPT_ENDPOINTS or readiness.ensure():
+            return None
+        abort(503)
+
+    @register_collector
+    def startup_metrics():
+        lines = ['# HELP trivia_startup_phase_seconds Time spent in each phase of the worker start.',
+                 '# TYPE trivia_startup_phase_seconds gauge']
+        for name, seconds in readiness.timer.phases:
+            lines.append('trivia_startup_phase_seconds{%s} %s'
+                         % (format_labels(('phase',), (name,)), repr(seconds)))
+        lines.append('trivia_ready %d' % readiness.ready)
+        return lines
+
+    if not db_setting(app.config, 'DB_LAZY_SETUP') and not readiness.ensure():
+        raise readiness.error
+    return readiness
+
+# Function to make sure the app's database is set up, for callers
+# outside a request (CLI commands, tests). Raises the setup error.
+def ensure_ready(app):
+    readiness = app.extensions['trivia_readiness']
+    if not readiness.ensure():
+        raise readiness.error
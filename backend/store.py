@@ -0,0 +1,200 @@
+import os
+import sys
+import threading
+from array import array
+from collections import deque
+from models import db, Question
+from question_index import QuestionIndex, NO_CATEGORY
+from metrics import register_collector, format_labels
+
+# Store setting, read from app.config, then the environment
+STORE_SETTINGS = {
+    'QUESTION_STORE': False,    # serve question reads from memory
+}
+
+# Rows read per round trip while the store loads
+LOAD_BATCH_SIZE = 10000
+
+# Freed row slots tolerated before the rows are compacted
+COMPACT_MIN_FREE = 1024
+
+def store_setting(config, name):
+    value = config.get(name, os.environ.get(name, STORE_SETTINGS[name]))
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+'''
+StoredQuestion
+    a question read from the QuestionStore. Has the attributes and
+    format() of Question, so routes serve either one the same way.
+'''
+class StoredQuestion:
+    __slots__ = ('id', 'question', 'answer', 'category', 'difficulty')
+
+    def __init__(self, id, question, answer, category, difficulty):
+        self.id = id
+        self.question = question
+        self.answer = answer
+        self.category = category
+        self.difficulty = difficulty
+
+    def format(self, fields=None):
+        if fields is not None:
+            return {field: getattr(self, field) for field in fields}
+        return {
+            'id': self.id,
+            'question': self.question,
+            'answer': self.answer,
+            'category': self.category,
+            'difficulty': self.difficulty
+        }
+
+'''
+QuestionStore
+    every question, held in parallel arrays: one row slot per question
+    with its category and difficulty in typed arrays and its texts in
+    lists of interned strings. A QuestionIndex maps ids to slots and
+    keeps the sorted id arrays that serve pages and filters.
+    Writes of this process arrive through log_change(), which only
+    appends to a change log; readers apply the log before reading, so
+    writers never wait on them.
+'''
+class QuestionStore:
+    def __init__(self, rows):
+        self.changes = deque()
+        self.lock = threading.Lock()
+        self._fill(rows)
+
+    def _fill(self, rows):
+        self.categories = array('l')
+        self.difficulties = array('l')
+        self.questions = []
+        self.answers = []
+        self.index = QuestionIndex()
+        self.free = []
+        for row in rows:
+            self._insert(*row)
+
+    def __len__(self):
+        return len(self.index)
+
+    # Function to queue a committed write, see on_change in models
+    def log_change(self, action, record):
+        self.changes.append((action, record.id, record.question, record.answer,
+                             record.category, record.difficulty))
+
+    def _catch_up(self):
+        while self.changes:
+            action, question_id, question, answer, category, difficulty = self.changes.popleft()
+            self._delete(question_id)
+            if action != 'delete':
+                self._insert(question_id, question, answer, category, difficulty)
+        if len(self.free) > max(COMPACT_MIN_FREE, len(self.index)):
+            self._compact()
+
+    def _insert(self, question_id, question, answer, category, difficulty):
+        # Every value is converted before a slot is written, so a value
+        # that cannot be stored leaves the row arrays aligned
+        values = (sys.intern(question or ''), sys.intern(answer or ''))
+        stored_category = NO_CATEGORY if category is None else int(category)
+        stored_difficulty = int(difficulty or 0)
+        if self.free:
+            slot = self.free.pop()
+            self.categories[slot] = stored_category
+            self.difficulties[slot] = stored_difficulty
+            self.questions[slot], self.answers[slot] = values
+        else:
+            slot = len(self.questions)
+            self.categories.append(stored_category)
+            self.difficulties.append(stored_difficulty)
+            self.questions.append(values[0])
+            self.answers.append(values[1])
+        self.index.add(question_id, category, difficulty, slot)
+
+    def _delete(self, question_id):
+        slot = self.index.remove(question_id)
+        if slot is None:
+            return
+        self.questions[slot] = self.answers[slot] = ''
+        self.free.append(slot)
+
+    # Function to rebuild the row arrays without their free slots
+    def _compact(self):
+        self._fill([self._row(question_id) for question_id in self.index.ids])
+
+    def _row(self, question_id):
+        slot = self.index.get(question_id)
+        category = self.categories[slot]
+        return (question_id, self.questions[slot], self.answers[slot],
+                None if category == NO_CATEGORY else category, self.difficulties[slot])
+
+    def _record(self, question_id):
+        return StoredQuestion(*self._row(question_id))
+
+    # Function to return a question by id, or None
+    def get(self, question_id):
+        with self.lock:
+            self._catch_up()
+            if question_id not in self.index:
+                return None
+            return self._record(question_id)
+
+    # Function to return the questions of the given ids that it holds,
+    # in the order of ids
+    def get_many(self, ids):
+        with self.lock:
+            self._catch_up()
+            return [self._record(question_id) for question_id in ids if question_id in self.index]
+
+    # Function to run select() of the index, see QuestionIndex. The
+    # returned array is a copy, safe to read while writes are applied.
+    def select(self, category_id=None, difficulty=None, among=None):
+        with self.lock:
+            self._catch_up()
+            return array('l', self.index.select(category_id, difficulty, among))
+
+    # Function to return the bytes held by the store, per part
+    def memory(self):
+        with self.lock:
+            self._catch_up()
+            index = self.index
+            arrays = sum(sys.getsizeof(values) for values in
+                         [self.categories, self.difficulties, index.ids]
+                         + list(index.category_ids.values()) + list(index.difficulty_ids.values()))
+            texts = {id(text): text for text in self.questions + self.answers}
+            return {
+                'arrays': arrays,
+                'texts': sys.getsizeof(self.questions) + sys.getsizeof(self.answers)
+                         + sum(sys.getsizeof(text) for text in texts.values()),
+                'index': sys.getsizeof(index.rows) + sum(sys.getsizeof(entry) for entry in index.rows.values()),
+            }
+
+# Function to load every question into a new QuestionStore with one
+# query, read in batches
+def load_question_store():
+    rows = (db.session.query(Question.id, Question.question, Question.answer,
+                             Question.category, Question.difficulty)
+            .order_by(Question.id).yield_per(LOAD_BATCH_SIZE))
+    return QuestionStore(rows)
+
+'''
+init_question_store(app, cache)
+    turns the store on for the app when QUESTION_STORE is set, and
+    reports its size in /metrics. cache is the VersionedCache that
+    holds the loaded store (lib.store_cache).
+'''
+def init_question_store(app, cache):
+    app.extensions['trivia_question_store'] = store_setting(app.config, 'QUESTION_STORE')
+
+    @register_collector
+    def question_store_metrics():
+        store = cache.value
+        if store is None:
+            return []
+        lines = ['trivia_question_store_questions %d' % len(store),
+                 '# HELP trivia_question_store_bytes Memory held by the question store.',
+                 '# TYPE trivia_question_store_bytes gauge']
+        for part, size in sorted(store.memory().items()):
+            lines.append('trivia_question_store_bytes{%s} %d' % (format_labels(('part',), (part,)), size))
+        return lines
@@ -0,0 +1,253 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from sqlalchemy.orm import make_transient
+from models import db, notify, bump_version, detach
+from routing import mark_write
+from metrics import Histogram, Counter, register_collector
+
+# Write-behind settings, read from app.config, then the environment
+WRITER_SETTINGS = {
+    'WRITE_BEHIND': False,      # coalesce inserts and deletes in a background thread
+    'WRITE_BATCH_SIZE': 100,    # most writes per transaction
+    'WRITE_BATCH_MS': 10,       # how long a batch waits for more writes
+    'WRITE_TIMEOUT': 30,        # seconds a caller waits for its write
+}
+
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+writer_log = logging.getLogger('trivia.writer')
+
+def writer_setting(config, name):
+    default = WRITER_SETTINGS[name]
+    value = config.get(name, os.environ.get(name, default))
+    if isinstance(default, bool) and isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return type(default)(value)
+
+batch_sizes = Histogram('trivia_write_batch_size',
+                        'Writes committed per write-behind transaction.', ('result',), BATCH_BUCKETS)
+batch_seconds = Histogram('trivia_write_batch_seconds',
+                          'Time spent writing one write-behind batch.', ('result',),
+                          (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+writes_total = Counter('trivia_writes_total', 'Writes handled by the write-behind writer.',
+                       ('model', 'action', 'result'))
+
+# One pending write: the record, what to do with it, and the future
+# its caller waits on
+class PendingWrite:
+    __slots__ = ('action', 'record', 'future')
+
+    def __init__(self, action, record):
+        self.action = action
+        self.record = record
+        self.future = Future()
+
+# Marks the end of the queue when the writer closes
+_CLOSE = object()
+
+'''
+BatchWriter(app, batch_size, batch_ms, timeout)
+    a background thread that commits queued inserts and deletes of
+    Question and Category records, up to batch_size of them in one
+    transaction, waiting at most batch_ms for a batch to fill. Each
+    batch bumps the versions it touches once, then notifies the change
+    listeners of every record, as the record methods do one by one.
+    submit() returns a Future with the record id; write() also waits
+    up to timeout seconds for it unless told not to, cancelling it if
+    it is still queued by then. A batch that fails is retried one
+    write per transaction, so a bad write only fails its own future.
+    close() writes what is queued, then stops the thread; writes
+    submitted after it are done synchronously by the caller.
+'''
+class BatchWriter:
+    def __init__(self, app, batch_size=100, batch_ms=10, timeout=30):
+        self.app = app
+        self.batch_size = batch_size
+        self.batch_seconds = batch_ms / 1000.0
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='trivia-writer', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    @property
+    def running(self):
+        return not self.closed and self.thread.is_alive()
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def submit(self, action, record):
+        # The write happens on the writer thread: keep the client of
+        # this request on the primary, as a write of its own would
+        mark_write()
+        write = PendingWrite(action, record)
+        self.queue.put(write)
+        return write.future
+
+    # Function to queue a write and, with wait, block until it commits.
+    # A write still queued after timeout seconds is cancelled, so the
+    # TimeoutError raised means it will not be written; one already in
+    # a batch being committed is waited for to the end.
+    def write(self, action, record, wait=True):
+        future = self.submit(action, record)
+        if wait:
+            try:
+                future.result(self.timeout)
+            except TimeoutError:
+                if future.cancel():
+                    writes_total.inc((type(record).__name__, action, 'cancelled'))
+                    raise
+                future.result()
+        return future
+
+    def close(self, timeout=None):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_CLOSE)
+        self.thread.join(timeout)
+
+    def _run(self):
+        closing = False
+        while not closing:
+            batch, closing = self._collect()
+            if batch:
+                self._write(batch)
+
+    # Function to wait for the next write, then gather more until the
+    # batch is full or batch_seconds have passed. Writes cancelled by
+    # their caller are dropped; the others can no longer be cancelled.
+    def _collect(self):
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if deadline is None:
+                write = self.queue.get()
+            else:
+                remaining = deadline - time.monotonic()
+                try:
+                    write = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if write is _CLOSE:
+                return batch, True
+            if write.future.set_running_or_notify_cancel():
+                batch.append(write)
+                if deadline is None:
+                    deadline = time.monotonic() + self.batch_seconds
+        return batch, False
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        with self.app.app_context():
+            try:
+                try:
+                    self._commit(batch)
+                    committed = batch
+                    result = 'ok'
+                except Exception:
+                    db.session.rollback()
+                    writer_log.exception('write-behind batch of %d failed, retrying one by one', len(batch))
+                    result = 'retried'
+                    committed = [write for write in batch if self._write_one(write)]
+                # Only what is committed is reported, once: a listener
+                # that fails must not make a committed write run again
+                self._resolve(committed)
+            finally:
+                db.session.remove()
+        batch_sizes.observe((result,), len(batch))
+        batch_seconds.observe((result,), time.perf_counter() - started)
+
+    # Function to commit one write of a failed batch on its own. Returns
+    # whether it committed; if not, its future gets the error.
+    def _write_one(self, write):
+        if write.action == 'insert':
+            # Forget the identity and id a failed batch may have assigned
+            make_transient(write.record)
+            write.record.id = None
+        try:
+            self._commit([write])
+            return True
+        except Exception as e:
+            db.session.rollback()
+            writes_total.inc((type(write.record).__name__, write.action, 'error'))
+            write.future.set_exception(e)
+            return False
+
+    # Function to write a batch in one transaction
+    def _commit(self, batch):
+        # Writes per table: listeners advance their caches once per
+        # notified write, so the versions move as many times
+        touched = {}
+        inserts = {}
+        deletes = {}
+        for write in batch:
+            model = type(write.record)
+            touched[model.__tablename__] = touched.get(model.__tablename__, 0) + 1
+            if write.action == 'insert':
+                db.session.add(write.record)
+                inserts.setdefault(model, []).append(write.record)
+            else:
+                deletes.setdefault(model, []).append(write.record.id)
+        db.session.flush()
+        for model, ids in deletes.items():
+            model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        for name in sorted(touched):
+            bump_version(name, touched[name])
+        # Reload the inserted rows, one query per model, so the records
+        # hold the values as stored ('2' sent for an integer column
+        # reads 2), then detach them before the commit expires them:
+        # callers and listeners read their values without a query
+        for model, records in inserts.items():
+            model.query.filter(model.id.in_([record.id for record in records])).populate_existing().all()
+            for record in records:
+                detach(record)
+        db.session.commit()
+
+    # Function to notify the change listeners of committed writes and
+    # resolve their futures. A listener error is logged: the write is
+    # committed all the same.
+    def _resolve(self, batch):
+        for write in batch:
+            try:
+                notify(write.action, write.record)
+            except Exception:
+                writer_log.exception('change listener failed after %s of %s %s', write.action,
+                                     type(write.record).__name__, write.record.id)
+            writes_total.inc((type(write.record).__name__, write.action, 'ok'))
+            write.future.set_result(write.record.id)
+
+'''
+init_writer(app)
+    starts the write-behind writer of the app when WRITE_BEHIND is
+    set, closes it at exit so queued writes are not lost, and reports
+    its queue depth and batches in /metrics.
+'''
+def init_writer(app):
+    writer = None
+    if writer_setting(app.config, 'WRITE_BEHIND'):
+        writer = BatchWriter(app, writer_setting(app.config, 'WRITE_BATCH_SIZE'),
+                             writer_setting(app.config, 'WRITE_BATCH_MS'),
+                             writer_setting(app.config, 'WRITE_TIMEOUT')).start()
+        app.extensions['trivia_writer'] = writer
+        atexit.register(writer.close)
+
+    @register_collector
+    def writer_metrics():
+        lines = ['# HELP trivia_write_queue_depth Writes waiting for the write-behind writer.',
+                 '# TYPE trivia_write_queue_depth gauge']
+        current = app.extensions.get('trivia_writer')
+        lines.append('trivia_write_queue_depth %d' % (current.depth() if current is not None else 0))
+        for metric in (batch_sizes, batch_seconds, writes_total):
+            lines.extend(metric.render())
+        return lines
+    return writer